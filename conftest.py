@@ -0,0 +1,23 @@
+import pytest
+
+
+@pytest.fixture(scope='session', autouse=True)
+def isolated_cache(tmp_path_factory):
+    """Общий кэш тестов во временном каталоге, а не в кэше сайта."""
+    from django.test import override_settings
+
+    from core.runner import isolated_caches
+
+    with override_settings(CACHES=isolated_caches(
+            str(tmp_path_factory.mktemp('cache')))):
+        yield
+
+
+@pytest.fixture(autouse=True)
+def thumbnails_inline(settings):
+    """Миниатюры создаются в самом запросе, а не фоновым потоком.
+
+    Тесты подменяют MEDIA_ROOT на время запроса и удаляют каталог
+    сразу после него, а поток пула записал бы файлы позже.
+    """
+    settings.THUMBNAIL_ASYNC = False
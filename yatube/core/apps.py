@@ -1,5 +1,17 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def clear_cache(**kwargs):
+    from django.core.cache import cache
+
+    # Общий кэш переживает пересоздание базы, а счётчики и версии
+    # в нём относятся к прежним данным.
+    cache.clear()
 
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        post_migrate.connect(clear_cache, sender=self)
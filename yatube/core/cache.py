@@ -0,0 +1,382 @@
+import os
+import pickle
+import sqlite3
+import time
+import uuid
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from threading import Lock
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.utils.module_loading import import_string
+
+# Сколько секунд ждать, пока другой процесс держит запись в SQLite.
+BUSY_TIMEOUT = 5
+# Ограничение SQLite на число параметров запроса — 999.
+QUERY_BATCH_SIZE = 500
+
+# Локальный уровень общий для всех потоков процесса, как у LocMemCache.
+_tiers = {}
+_tiers_lock = Lock()
+
+_missing = object()
+
+
+class LocalTier:
+    """LRU в памяти процесса с ограничением размера и времени жизни."""
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        # Метка записей этого процесса в журнале общего кэша.
+        self.origin = uuid.uuid4().hex
+        self.seq = None
+        self.synced = 0
+        self.stats = {'local': Counter(), 'shared': Counter()}
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return _missing
+            pickled, expires = entry
+            if expires <= time.monotonic():
+                del self.entries[key]
+                return _missing
+            self.entries.move_to_end(key)
+        return pickle.loads(pickled)
+
+    def set(self, key, value, timeout):
+        pickled = pickle.dumps(value, self.pickle_protocol)
+        with self.lock:
+            self.entries[key] = pickled, time.monotonic() + timeout
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class SQLiteCache(BaseCache):
+    """Общий для процессов кэш в отдельном файле SQLite.
+
+    add() и incr() атомарны: проверка и запись идут в одной транзакции
+    BEGIN IMMEDIATE, а incr() не трогает срок жизни ключа. Сверх
+    MAX_ENTRIES удаляются просроченные записи, затем каждая
+    CULL_FREQUENCY-я из тех, что истекают раньше; вечные — последними.
+    Изменённые ключи пишутся в журнал из LOG_SIZE последних записей
+    с меткой origin, по которому TwoLevelCache сбрасывает локальные
+    копии ключей, изменённых другими процессами.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self.path = location
+        self.log_size = params.get('OPTIONS', {}).get('LOG_SIZE', 10000)
+        self.origin = None
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT,
+                                         isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, '
+                'value BLOB NOT NULL, expires REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS cache_expires '
+                               'ON cache (expires)')
+            # Пустой key в журнале означает, что кэш очищен целиком.
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS changes '
+                '(seq INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT, '
+                'origin TEXT)')
+            self._connection = connection
+        return self._connection
+
+    @contextmanager
+    def _write(self):
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def _key(self, key, version):
+        key = self.make_key(key, version)
+        self.validate_key(key)
+        return key
+
+    def _log(self, connection, keys):
+        connection.executemany(
+            'INSERT INTO changes (key, origin) VALUES (?, ?)',
+            ((key, self.origin) for key in keys))
+        last, = connection.execute('SELECT MAX(seq) FROM changes').fetchone()
+        connection.execute('DELETE FROM changes WHERE seq <= ?',
+                           (last - self.log_size,))
+
+    def _cull(self, connection):
+        now = time.time()
+        count, = connection.execute('SELECT COUNT(*) FROM cache').fetchone()
+        if count <= self._max_entries:
+            return
+        connection.execute('DELETE FROM cache WHERE expires <= ?', (now,))
+        count, = connection.execute('SELECT COUNT(*) FROM cache').fetchone()
+        if count <= self._max_entries:
+            return
+        connection.execute(
+            'DELETE FROM cache WHERE key IN (SELECT key FROM cache '
+            'ORDER BY expires IS NULL, expires LIMIT ?)',
+            (max(count // self._cull_frequency, 1),))
+
+    def _live(self, connection, keys):
+        found = {}
+        for start in range(0, len(keys), QUERY_BATCH_SIZE):
+            batch = keys[start:start + QUERY_BATCH_SIZE]
+            rows = connection.execute(
+                'SELECT key, value FROM cache WHERE key IN (%s) '
+                'AND (expires IS NULL OR expires > ?)'
+                % ', '.join('?' * len(batch)), (*batch, time.time()))
+            found.update((key, pickle.loads(value)) for key, value in rows)
+        return found
+
+    def changes(self, since):
+        """Номер последней записи и ключи, изменённые после since
+        с другой меткой origin.
+
+        Вместо ключей возвращается None, если изменения неизвестны:
+        since не задан, журнал уже обрезан или пересоздан, кэш очищали
+        целиком.
+        """
+        connection = self._connect()
+        first, last = connection.execute(
+            'SELECT MIN(seq), MAX(seq) FROM changes').fetchone()
+        last = last or 0
+        if since is None or since > last or (first or 0) > since + 1:
+            return last, None
+        keys = set()
+        for key, in connection.execute(
+                'SELECT key FROM changes WHERE seq > ? AND seq <= ? '
+                'AND origin IS NOT ?', (since, last, self.origin)):
+            if key is None:
+                return last, None
+            keys.add(key)
+        return last, keys
+
+    def get(self, key, default=None, version=None):
+        return self.get_many([key], version=version).get(key, default)
+
+    def get_many(self, keys, version=None):
+        made = {self._key(key, version): key for key in keys}
+        found = self._live(self._connect(), list(made))
+        return {made[key]: value for key, value in found.items()}
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        with self._write() as connection:
+            if self._live(connection, [key]):
+                return False
+            self._store(connection, {key: value}, timeout)
+        return True
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        data = {self._key(key, version): value for key, value in data.items()}
+        with self._write() as connection:
+            self._store(connection, data, timeout)
+        return []
+
+    def _store(self, connection, data, timeout):
+        expires = self.get_backend_timeout(timeout)
+        connection.executemany(
+            'INSERT OR REPLACE INTO cache (key, value, expires) '
+            'VALUES (?, ?, ?)',
+            ((key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), expires)
+             for key, value in data.items()))
+        self._log(connection, data)
+        self._cull(connection)
+
+    def incr(self, key, delta=1, version=None):
+        made = self._key(key, version)
+        with self._write() as connection:
+            found = self._live(connection, [made])
+            if not found:
+                raise ValueError("Key '%s' not found" % key)
+            value = found[made] + delta
+            connection.execute(
+                'UPDATE cache SET value = ? WHERE key = ?',
+                (pickle.dumps(value, pickle.HIGHEST_PROTOCOL), made))
+            self._log(connection, [made])
+        return value
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        with self._write() as connection:
+            cursor = connection.execute(
+                'UPDATE cache SET expires = ? WHERE key = ? '
+                'AND (expires IS NULL OR expires > ?)',
+                (self.get_backend_timeout(timeout), key, time.time()))
+        return cursor.rowcount > 0
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version)
+
+    def delete_many(self, keys, version=None):
+        keys = [self._key(key, version) for key in keys]
+        with self._write() as connection:
+            connection.executemany('DELETE FROM cache WHERE key = ?',
+                                   ((key,) for key in keys))
+            self._log(connection, keys)
+
+    def has_key(self, key, version=None):
+        return bool(self.get_many([key], version=version))
+
+    def clear(self):
+        with self._write() as connection:
+            connection.execute('DELETE FROM cache')
+            self._log(connection, [None])
+
+
+class TwoLevelCache(BaseCache):
+    """Кэш в памяти процесса перед общим для всех процессов хранилищем.
+
+    Чтение сначала идёт в локальный LRU (LOCAL_MAX_ENTRIES записей,
+    не дольше LOCAL_TIMEOUT секунд), затем в общий кэш из OPTIONS['SHARED'],
+    который ведёт журнал изменений, как SQLiteCache. Не чаще раза в
+    SYNC_INTERVAL секунд процесс читает журнал и сбрасывает локальные
+    копии изменённых с прошлого раза ключей. Счётчики попаданий и
+    промахов каждого уровня возвращает stats().
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        shared = options['SHARED']
+        self.shared = import_string(shared['BACKEND'])(
+            shared.get('LOCATION', ''), shared)
+        self.local_timeout = options.get('LOCAL_TIMEOUT', 5)
+        self.sync_interval = options.get('SYNC_INTERVAL', 1)
+        name = location or shared.get('LOCATION', '')
+        with _tiers_lock:
+            self.local = _tiers.setdefault(
+                name, LocalTier(options.get('LOCAL_MAX_ENTRIES', 1000)))
+        self.shared.origin = self.local.origin
+
+    def _local_timeout(self, timeout):
+        timeout = self.get_backend_timeout(timeout)
+        if timeout is None:
+            return self.local_timeout
+        return max(0, min(self.local_timeout, timeout - time.time()))
+
+    def _sync(self):
+        """Сбрасывает локальные копии ключей, изменённых в общем кэше."""
+        now = time.monotonic()
+        if now - self.local.synced < self.sync_interval:
+            return
+        seq, keys = self.shared.changes(self.local.seq)
+        if keys is None:
+            # До первой сверки в локальном уровне только свои записи.
+            if self.local.seq is not None:
+                self.local.clear()
+        else:
+            for key in keys:
+                self.local.delete(key)
+        self.local.seq = seq
+        self.local.synced = now
+
+    def _local_key(self, key, version):
+        # Ключи локального уровня совпадают с ключами журнала.
+        return self.shared.make_key(key, version)
+
+    def stats(self):
+        return {tier: dict(counter)
+                for tier, counter in self.local.stats.items()}
+
+    def get(self, key, default=None, version=None):
+        return self.get_many([key], version=version).get(key, default)
+
+    def get_many(self, keys, version=None):
+        self._sync()
+        found = {}
+        missing = []
+        for key in keys:
+            value = self.local.get(self._local_key(key, version))
+            if value is _missing:
+                missing.append(key)
+            else:
+                found[key] = value
+        stats = self.local.stats
+        stats['local'].update(hits=len(found), misses=len(missing))
+        if missing:
+            shared = self.shared.get_many(missing, version=version)
+            stats['shared'].update(hits=len(shared),
+                                   misses=len(missing) - len(shared))
+            for key, value in shared.items():
+                self.local.set(self._local_key(key, version), value,
+                               self.local_timeout)
+            found.update(shared)
+        return found
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout, version)
+        if added:
+            self.local.set(self._local_key(key, version), value,
+                           self._local_timeout(timeout))
+        return added
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version) or []
+        local_timeout = self._local_timeout(timeout)
+        for key, value in data.items():
+            if key not in failed:
+                self.local.set(self._local_key(key, version), value,
+                               local_timeout)
+        return failed
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self.local.delete(self._local_key(key, version))
+        return self.shared.touch(key, timeout, version)
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version)
+
+    def delete_many(self, keys, version=None):
+        self.shared.delete_many(keys, version)
+        for key in keys:
+            self.local.delete(self._local_key(key, version))
+
+    def incr(self, key, delta=1, version=None):
+        value = self.shared.incr(key, delta, version)
+        self.local.set(self._local_key(key, version), value,
+                       self.local_timeout)
+        return value
+
+    def has_key(self, key, version=None):
+        return key in self.get_many([key], version=version)
+
+    def clear(self):
+        self.shared.clear()
+        self.local.clear()
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
@@ -0,0 +1,39 @@
+import logging
+
+from django.conf import settings
+from django.db import connection
+
+from .query_budget import QueryBudgetExceeded, QueryRecorder
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetMiddleware:
+    """Считает SQL-запросы каждого запроса и сообщает о перерасходе.
+
+    Бюджет берётся из QUERY_BUDGETS по имени view (или
+    QUERY_BUDGET_DEFAULT); одинаковый по форме запрос чаще
+    QUERY_REPEAT_LIMIT раз считается признаком N+1. С
+    QUERY_BUDGET_RAISE = True вместо предупреждения бросается
+    QueryBudgetExceeded — так тесты падают на регрессиях.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+
+        match = request.resolver_match
+        view_name = match.view_name if match else request.path
+        problems = recorder.problems(
+            settings.QUERY_BUDGETS.get(view_name))
+        if problems:
+            message = (f'{request.method} {request.path} ({view_name}): '
+                       + '; '.join(problems))
+            if settings.QUERY_BUDGET_RAISE:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
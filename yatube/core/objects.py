@@ -0,0 +1,100 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import post_delete, post_save
+from django.http import Http404
+
+# Модель -> имена полей, которые хранятся в кэше.
+_fields = {}
+
+
+def _label(model):
+    return model._meta.label_lower
+
+
+def _key(model, pk):
+    return f'core:object:{_label(model)}:{pk}'
+
+
+def _alias_key(model, field, value):
+    return f'core:object:{_label(model)}:{field}={value}'
+
+
+def _pack(model, instance):
+    fields = [model._meta.get_field(name) for name in _fields[model]]
+    return tuple(field.get_prep_value(getattr(instance, field.attname))
+                 for field in fields)
+
+
+def _unpack(model, values):
+    if values is None or len(values) != len(_fields[model]):
+        return None
+    attnames = [model._meta.get_field(name).attname
+                for name in _fields[model]]
+    return model.from_db(DEFAULT_DB_ALIAS, attnames, values)
+
+
+def get_cached(model, **lookup):
+    """Объект по первичному ключу или уникальному полю через кэш.
+
+    В кэше лежит кортеж значений полей, а не pickle экземпляра; поиск
+    по другому полю хранит ссылку на первичный ключ. Если объекта нет,
+    бросается model.DoesNotExist.
+    """
+    (field, value), = lookup.items()
+    pk_name = model._meta.pk.name
+    if field in ('pk', pk_name):
+        pk = value
+    else:
+        pk = cache.get(_alias_key(model, field, value))
+    if pk is not None:
+        instance = _unpack(model, cache.get(_key(model, pk)))
+        # Ссылка могла устареть, если поле объекта изменилось.
+        if instance is not None and (field in ('pk', pk_name)
+                                     or getattr(instance, field) == value):
+            return instance
+
+    instance = model._default_manager.only(*_fields[model]).get(**lookup)
+    cache.set(_key(model, instance.pk), _pack(model, instance),
+              settings.OBJECT_CACHE_TIMEOUT)
+    if field not in ('pk', pk_name):
+        cache.set(_alias_key(model, field, value), instance.pk,
+                  settings.OBJECT_CACHE_TIMEOUT)
+    return instance
+
+
+def get_cached_or_404(model, **lookup):
+    try:
+        return get_cached(model, **lookup)
+    except model.DoesNotExist:
+        raise Http404(f'No {model._meta.object_name} matches the query.')
+
+
+def forget(model, **lookup):
+    """Сбрасывает объект, найденный по тому же полю, что и в get_cached()."""
+    (field, value), = lookup.items()
+    if field in ('pk', model._meta.pk.name):
+        cache.delete(_key(model, value))
+        return
+    alias_key = _alias_key(model, field, value)
+    pk = cache.get(alias_key)
+    keys = [alias_key] if pk is None else [alias_key, _key(model, pk)]
+    cache.delete_many(keys)
+
+
+def _forget_instance(sender, instance, **kwargs):
+    forget(sender, pk=instance.pk)
+
+
+def watch(model, fields=None):
+    """Включает кэш для модели и сброс записи при save()/delete().
+
+    fields ограничивает хранимые поля; остальные будут отложенными.
+    """
+    # Порядок полей — как в модели: этого требует Model.from_db().
+    _fields[model] = tuple(
+        field.name for field in model._meta.concrete_fields
+        if fields is None or field.name in fields)
+    uid = f'core.objects:{_label(model)}'
+    post_save.connect(_forget_instance, sender=model, dispatch_uid=uid)
+    post_delete.connect(_forget_instance, sender=model, dispatch_uid=uid)
@@ -0,0 +1,64 @@
+import re
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+
+PLACEHOLDER_LIST = re.compile(r'\((?:%s|\?)(?:\s*,\s*(?:%s|\?))+\)')
+NUMBER = re.compile(r'\b\d+\b')
+STRING = re.compile(r"'(?:[^']|'')*'")
+TRANSACTION = re.compile(r'^\s*(BEGIN|COMMIT|ROLLBACK|SAVEPOINT|RELEASE)\b',
+                         re.IGNORECASE)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_shape(sql):
+    """SQL без значений: одинаковые запросы с разными id совпадают."""
+    sql = STRING.sub('?', sql)
+    sql = NUMBER.sub('?', sql)
+    return PLACEHOLDER_LIST.sub('(...)', sql)
+
+
+class QueryRecorder:
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not TRANSACTION.match(sql):
+            self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+    def problems(self, budget=None, repeat_limit=None):
+        if budget is None:
+            budget = settings.QUERY_BUDGET_DEFAULT
+        if repeat_limit is None:
+            repeat_limit = settings.QUERY_REPEAT_LIMIT
+        problems = []
+        if len(self.queries) > budget:
+            problems.append(f'{len(self.queries)} запросов при бюджете '
+                            f'{budget}')
+        shapes = Counter(query_shape(sql) for sql in self.queries)
+        problems.extend(
+            f'{count} раз(а): {shape}'
+            for shape, count in shapes.most_common() if count > repeat_limit
+        )
+        return problems
+
+
+@contextmanager
+def assert_query_budget(budget=None, repeat_limit=None):
+    """Проверка для тестов: блок укладывается в бюджет и не даёт N+1.
+
+    with assert_query_budget(5):
+        client.get('/')
+    """
+    recorder = QueryRecorder()
+    with connection.execute_wrapper(recorder):
+        yield recorder
+    problems = recorder.problems(budget, repeat_limit)
+    if problems:
+        raise QueryBudgetExceeded('\n'.join(problems))
@@ -0,0 +1,38 @@
+import copy
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+
+def isolated_caches(directory):
+    """CACHES, у которых общий уровень лежит в directory.
+
+    Тесты очищают кэш, а миграция тестовой базы сбрасывает его через
+    post_migrate; без этого они стирали бы кэш работающего сайта.
+    """
+    caches = copy.deepcopy(settings.CACHES)
+    for params in caches.values():
+        shared = params.get('OPTIONS', {}).get('SHARED', params)
+        shared['LOCATION'] = os.path.join(
+            directory, os.path.basename(shared.get('LOCATION', '')))
+    return caches
+
+
+class IsolatedCacheRunner(DiscoverRunner):
+    """Запускает тесты с общим кэшем во временном каталоге."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.cache_directory = tempfile.mkdtemp()
+        self.cache_override = override_settings(
+            CACHES=isolated_caches(self.cache_directory))
+        self.cache_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.cache_override.disable()
+        shutil.rmtree(self.cache_directory, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,85 @@
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+POLL_INTERVAL = 0.05
+
+_missing = object()
+
+
+def _lease_key(key):
+    return f'{key}:lease'
+
+
+def acquire(key):
+    """Берёт аренду на пересчёт ключа; успешно только у одного воркера."""
+    return cache.add(_lease_key(key), True, settings.STAMPEDE_LEASE_TIMEOUT)
+
+
+def release(key):
+    cache.delete(_lease_key(key))
+
+
+@contextmanager
+def locked(key):
+    """Аренда ключа на время блока; ждёт её до STAMPEDE_WAIT секунд.
+
+    Отдаёт True, если аренда взята, иначе False: тогда блок сам решает,
+    можно ли работать без неё.
+    """
+    deadline = time.monotonic() + settings.STAMPEDE_WAIT
+    acquired = acquire(key)
+    while not acquired and time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        acquired = acquire(key)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            release(key)
+
+
+def _refresh(key, compute, timeout, grace):
+    try:
+        value = compute()
+        cache.set(key, value, timeout + grace)
+        cache.set(f'{key}:fresh', True, timeout)
+    finally:
+        release(key)
+    return value
+
+
+def _wait(key):
+    deadline = time.monotonic() + settings.STAMPEDE_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        value = cache.get(key, _missing)
+        if value is not _missing:
+            return value
+    return _missing
+
+
+def get_or_compute(key, compute, timeout, grace=None):
+    """Значение из кэша с пересчётом только в одном воркере.
+
+    Значение хранится timeout + grace секунд, метка свежести — timeout.
+    Когда метка истекла, значение пересчитывает воркер, взявший аренду,
+    а остальные пока отдают прежнее. Если значения нет совсем, остальные
+    ждут пересчёта до STAMPEDE_WAIT секунд и лишь потом считают сами.
+    Значение хранится под самим key, поэтому cache.incr() с ним работает.
+    """
+    if grace is None:
+        grace = settings.STAMPEDE_GRACE
+    found = cache.get_many([key, f'{key}:fresh'])
+    if key in found:
+        if f'{key}:fresh' in found or not acquire(key):
+            return found[key]
+        return _refresh(key, compute, timeout, grace)
+    if acquire(key):
+        return _refresh(key, compute, timeout, grace)
+    value = _wait(key)
+    if value is _missing:
+        value = compute()
+    return value
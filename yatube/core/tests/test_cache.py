@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+from threading import Thread
+
+from django.test import SimpleTestCase
+
+from ..cache import SQLiteCache, TwoLevelCache
+
+
+class TwoLevelCacheTest(SimpleTestCase):
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location, True)
+        self.first = self._cache('first')
+        self.second = self._cache('second')
+
+    def _cache(self, name, **options):
+        # Разные name — разные локальные уровни, как в двух процессах.
+        return TwoLevelCache(f'{self.location}:{name}', {'OPTIONS': {
+            'SYNC_INTERVAL': 0,
+            'SHARED': {
+                'BACKEND': 'core.cache.SQLiteCache',
+                'LOCATION': os.path.join(self.location, 'cache.sqlite3'),
+            },
+            **options,
+        }})
+
+    def test_tiers(self):
+        self.first.set('key', 'value')
+        self.assertEqual('value', self.first.get('key'))
+        self.assertEqual({'hits': 1, 'misses': 0},
+                         self.first.stats()['local'])
+
+        self.assertEqual('value', self.second.get('key'))
+        self.assertEqual('value', self.second.get('key'))
+        self.assertEqual({'hits': 1, 'misses': 1},
+                         self.second.stats()['local'])
+        self.assertEqual({'hits': 1, 'misses': 0},
+                         self.second.stats()['shared'])
+
+    def test_writes_invalidate_other_processes(self):
+        self.first.set('key', 1)
+        self.second.get('key')
+        self.first.incr('key')
+        self.assertEqual(2, self.second.get('key'))
+        self.first.delete('key')
+        self.assertIsNone(self.second.get('key'))
+
+    def test_writes_keep_unrelated_local_entries(self):
+        self.first.set_many({'a': 1, 'b': 2})
+        self.second.get_many(['a', 'b'])
+        self.first.set('a', 3)
+        self.assertEqual({'a': 3, 'b': 2}, self.second.get_many(['a', 'b']))
+        self.assertEqual({'hits': 1, 'misses': 3},
+                         self.second.stats()['local'])
+
+    def test_clear_resets_other_processes(self):
+        self.first.set('key', 1)
+        self.second.get('key')
+        self.first.clear()
+        self.assertIsNone(self.second.get('key'))
+
+    def test_local_tier_is_bounded(self):
+        cache = self._cache('bounded', LOCAL_MAX_ENTRIES=2)
+        cache.set_many({'a': 1, 'b': 2, 'c': 3})
+        self.assertEqual(2, len(cache.local.entries))
+        self.assertEqual({'a': 1, 'b': 2, 'c': 3},
+                         cache.get_many(['a', 'b', 'c']))
+
+
+class SQLiteCacheTest(SimpleTestCase):
+    def setUp(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location, True)
+        self.path = os.path.join(location, 'cache.sqlite3')
+        self.cache = self._cache()
+
+    def _cache(self, **options):
+        return SQLiteCache(self.path, {'OPTIONS': options})
+
+    def _expires(self, key):
+        return self.cache._connect().execute(
+            'SELECT expires FROM cache WHERE key = ?',
+            (self.cache.make_key(key),)).fetchone()[0]
+
+    def test_add_is_exclusive(self):
+        self.assertTrue(self.cache.add('lease', 1))
+        self.assertFalse(self._cache().add('lease', 2))
+        self.assertEqual(1, self.cache.get('lease'))
+
+    def test_concurrent_increments_are_not_lost(self):
+        self.cache.set('counter', 0)
+
+        def work():
+            cache = self._cache()
+            for _ in range(50):
+                cache.incr('counter')
+
+        threads = [Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(200, self.cache.get('counter'))
+
+    def test_incr_keeps_timeout(self):
+        self.cache.set('counter', 1, 1000)
+        expires = self._expires('counter')
+        self.cache.incr('counter')
+        self.assertEqual(expires, self._expires('counter'))
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+    def test_cull_keeps_keys_without_timeout(self):
+        cache = self._cache(MAX_ENTRIES=3, CULL_FREQUENCY=2)
+        cache.set('version', 1, None)
+        cache.set_many({f'page:{i}': i for i in range(4)}, 100)
+        self.assertEqual(1, cache.get('version'))
+        self.assertLessEqual(
+            len(cache.get_many([f'page:{i}' for i in range(4)])), 2)
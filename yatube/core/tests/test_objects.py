@@ -0,0 +1,55 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+
+from posts.models import Follow, Group, Profile
+from ..objects import _key, get_cached
+
+User = get_user_model()
+
+
+class ObjectCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.group = Group.objects.create(title='Группа', slug='group',
+                                         description='Описание')
+        cls.user = User.objects.create_user(username='user',
+                                            password='secret')
+        cls.author = User.objects.create_user(username='author')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_read_through(self):
+        get_cached(Group, slug='group')
+        with self.assertNumQueries(0):
+            group = get_cached(Group, slug='group')
+            self.assertEqual(group, get_cached(Group, pk=self.group.pk))
+        self.assertEqual(
+            (self.group.pk, 'Группа', 'group', 'Описание'),
+            cache.get(_key(Group, self.group.pk)))
+
+    def test_save_and_delete_invalidate(self):
+        get_cached(Group, slug='group')
+        self.group.slug = 'renamed'
+        self.group.save()
+        with self.assertRaises(Group.DoesNotExist):
+            get_cached(Group, slug='group')
+        self.assertEqual('renamed', get_cached(Group, pk=self.group.pk).slug)
+
+        self.group.delete()
+        with self.assertRaises(Group.DoesNotExist):
+            get_cached(Group, slug='renamed')
+
+    def test_user_password_is_not_cached(self):
+        user = get_cached(User, username='user')
+        self.assertIn('password', user.get_deferred_fields())
+        self.assertNotIn(self.user.password,
+                         cache.get(_key(User, self.user.pk)))
+
+    def test_counter_updates_invalidate_profile(self):
+        self.assertEqual(
+            0, get_cached(Profile, user_id=self.author.pk).followers_count)
+        Follow.objects.create(user=self.user, author=self.author)
+        self.assertEqual(
+            1, get_cached(Profile, user_id=self.author.pk).followers_count)
@@ -0,0 +1,56 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from posts.models import Post
+from ..query_budget import (QueryBudgetExceeded, assert_query_budget,
+                            query_shape)
+
+User = get_user_model()
+
+
+class QueryBudgetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='budget')
+        Post.objects.bulk_create(
+            Post(author=cls.user, text=f'Пост {i}') for i in range(5))
+        cls.profile_url = reverse('posts:profile',
+                                  kwargs={'username': cls.user.username})
+
+    def setUp(self):
+        cache.clear()
+
+    def test_query_shape_ignores_values(self):
+        self.assertEqual(
+            query_shape('SELECT * FROM t WHERE id = 1 AND name = \'a\''),
+            query_shape('SELECT * FROM t WHERE id = 22 AND name = \'b\''))
+        self.assertEqual(
+            query_shape('SELECT * FROM t WHERE id IN (%s, %s)'),
+            query_shape('SELECT * FROM t WHERE id IN (%s, %s, %s)'))
+
+    def test_budget(self):
+        with assert_query_budget(1):
+            User.objects.count()
+        with self.assertRaises(QueryBudgetExceeded):
+            with assert_query_budget(1):
+                User.objects.count()
+                Post.objects.count()
+
+    def test_repeated_queries(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            with assert_query_budget(repeat_limit=2):
+                for post in Post.objects.all():
+                    post.author.username
+
+    @override_settings(QUERY_BUDGET_RAISE=True,
+                       QUERY_BUDGETS={'posts:profile': 1})
+    def test_middleware_raises_over_budget(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get(self.profile_url)
+
+    @override_settings(QUERY_BUDGETS={'posts:profile': 1})
+    def test_middleware_warns_over_budget(self):
+        with self.assertLogs('core.middleware', 'WARNING'):
+            self.client.get(self.profile_url)
@@ -0,0 +1,42 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from .. import singleflight
+from ..singleflight import get_or_compute
+
+
+class GetOrComputeTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.compute = mock.Mock(return_value=1)
+
+    def test_fresh_value_is_not_recomputed(self):
+        self.assertEqual(1, get_or_compute('key', self.compute, 60))
+        self.assertEqual(1, get_or_compute('key', self.compute, 60))
+        self.assertEqual(1, self.compute.call_count)
+
+    def test_value_supports_incr(self):
+        get_or_compute('key', self.compute, 60)
+        cache.incr('key')
+        self.assertEqual(2, get_or_compute('key', self.compute, 60))
+
+    def test_stale_value_is_served_during_refresh(self):
+        get_or_compute('key', self.compute, 60)
+        cache.delete('key:fresh')
+        self.compute.return_value = 2
+        self.assertTrue(singleflight.acquire('key'))
+        self.assertEqual(1, get_or_compute('key', self.compute, 60))
+        self.assertEqual(1, self.compute.call_count)
+
+        singleflight.release('key')
+        self.assertEqual(2, get_or_compute('key', self.compute, 60))
+
+    @override_settings(STAMPEDE_WAIT=0.1)
+    def test_missing_value_waits_for_lease_holder(self):
+        self.assertTrue(singleflight.acquire('key'))
+        with mock.patch.object(singleflight.time, 'sleep',
+                               side_effect=lambda _: cache.set('key', 5)):
+            self.assertEqual(5, get_or_compute('key', self.compute, 60))
+        self.compute.assert_not_called()
@@ -0,0 +1,63 @@
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Comment, Follow, Post, Profile
+
+User = get_user_model()
+
+# id в одном UPDATE ... WHERE IN: SQLite ограничивает число параметров.
+UPDATE_BATCH_SIZE = 500
+
+
+def bump(queryset, **deltas):
+    """Атомарно меняет счётчики одним UPDATE, не опускаясь ниже нуля."""
+    queryset.update(**{
+        field: F(field) + delta if delta > 0 else Greatest(F(field) + delta,
+                                                           0)
+        for field, delta in deltas.items()
+    })
+
+
+def _count(model, field, outer_field='pk'):
+    rows = model.objects.filter(**{field: OuterRef(outer_field)})
+    return Coalesce(Subquery(
+        rows.order_by().values(field).annotate(
+            total=Count('pk')).values('total')
+    ), 0)
+
+
+def _changed(queryset, counters, id_field):
+    """id строк, у которых хоть один счётчик расходится с фактическим."""
+    actual = {f'actual_{field}': count for field, count in counters.items()}
+    return list(queryset.annotate(**actual).exclude(**{
+        field: F(f'actual_{field}') for field in counters
+    }).values_list(id_field, flat=True))
+
+
+def recount():
+    """Пересчитывает все счётчики по фактическим данным.
+
+    Возвращает id пользователей, чьи профили изменились, и id
+    изменившихся постов: их записи в кэше нужно сбросить.
+    """
+    missing = User.objects.filter(profile__isnull=True).values_list(
+        'pk', flat=True)
+    Profile.objects.bulk_create(Profile(user_id=pk) for pk in missing)
+    profile_counters = {
+        'posts_count': _count(Post, 'author', 'user'),
+        'followers_count': _count(Follow, 'author', 'user'),
+        'following_count': _count(Follow, 'user', 'user'),
+    }
+    post_counters = {'comments_count': _count(Comment, 'post')}
+    user_ids = _changed(Profile.objects.all(), profile_counters, 'user_id')
+    post_ids = _changed(Post.objects.all(), post_counters, 'pk')
+    for start in range(0, len(user_ids), UPDATE_BATCH_SIZE):
+        Profile.objects.filter(
+            user_id__in=user_ids[start:start + UPDATE_BATCH_SIZE]
+        ).update(**profile_counters)
+    for start in range(0, len(post_ids), UPDATE_BATCH_SIZE):
+        Post.objects.filter(
+            pk__in=post_ids[start:start + UPDATE_BATCH_SIZE]
+        ).update(**post_counters)
+    return user_ids, post_ids
@@ -0,0 +1,69 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from core.singleflight import get_or_compute
+
+
+def feed_key(feed, pk=None):
+    return feed if pk is None else f'{feed}:{pk}'
+
+
+def post_feed_keys(post, followers):
+    """Ленты, в которых виден пост: общая, автора, группы и подписчиков."""
+    keys = [feed_key('index'), feed_key('author', post.author_id)]
+    if post.group_id:
+        keys.append(feed_key('group', post.group_id))
+    keys.extend(feed_key('follow', user_id) for user_id in followers)
+    return keys
+
+
+def _cache_key(key):
+    return f'posts:count:{key}'
+
+
+def estimate_count(model):
+    """Оценка числа строк без полного COUNT(*)."""
+    opts = model._meta
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE relname = %s',
+                [opts.db_table]
+            )
+        else:
+            # Максимальный id берётся из индекса первичного ключа
+            # и даёт оценку сверху: удалённые строки не вычитаются.
+            quote = connection.ops.quote_name
+            cursor.execute(
+                f'SELECT MAX({quote(opts.pk.column)}) '
+                f'FROM {quote(opts.db_table)}'
+            )
+        row = cursor.fetchone()
+    return (row[0] or 0) if row else 0
+
+
+def _count(queryset):
+    if not queryset.query.where:
+        estimate = estimate_count(queryset.model)
+        if estimate >= settings.FEED_COUNT_ESTIMATE_THRESHOLD:
+            return estimate
+    return queryset.count()
+
+
+def get_count(key, queryset):
+    return get_or_compute(_cache_key(key), lambda: _count(queryset),
+                          settings.FEED_COUNT_TIMEOUT)
+
+
+def change_counts(keys, delta):
+    for key in keys:
+        try:
+            cache.incr(_cache_key(key), delta)
+        except ValueError:
+            # Счётчика нет в кэше — он будет посчитан при первом запросе.
+            pass
+
+
+def forget_counts(keys):
+    cache.delete_many([_cache_key(key) for key in keys])
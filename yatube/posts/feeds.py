@@ -0,0 +1,193 @@
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+from core import objects
+from core.singleflight import get_or_compute, locked
+
+from .models import FEED_FIELDS, Follow, Post, Profile, TimelineEntry
+
+CELEBRITIES_KEY = 'posts:celebrities'
+
+
+def celebrity_ids():
+    """Авторы, чьи посты подмешиваются при чтении ленты.
+
+    Кроме популярных авторов, сюда входят те, чьи посты уже хоть раз
+    не раскладывались: иначе после отписок эти посты пропали бы из лент.
+    """
+    return get_or_compute(
+        CELEBRITIES_KEY,
+        lambda: frozenset(Profile.objects.filter(
+            Q(followers_count__gte=settings.FEED_CELEBRITY_FOLLOWERS)
+            | Q(pull_posts=True)
+        ).values_list('user_id', flat=True)),
+        settings.FEED_CELEBRITY_TIMEOUT
+    )
+
+
+def is_celebrity(author_id):
+    return author_id in celebrity_ids()
+
+
+def push_targets(author_id):
+    """Подписчики, в ленты которых раскладываются посты автора."""
+    if is_celebrity(author_id):
+        return []
+    return list(Follow.objects.filter(
+        author_id=author_id).values_list('user_id', flat=True))
+
+
+def fan_out(post, user_ids):
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, post_id=post.pk,
+                       author_id=post.author_id, pub_date=post.pub_date)
+         for user_id in user_ids),
+        batch_size=settings.FEED_BATCH_SIZE
+    )
+
+
+def push_post(post):
+    """Раскладывает новый пост по лентам подписчиков автора.
+
+    Возвращает id подписчиков, получивших пост; посты популярных
+    авторов не раскладываются и подмешиваются при чтении ленты.
+    """
+    followers = push_targets(post.author_id)
+    if not followers and is_celebrity(post.author_id):
+        _keep_pulling(post.author_id)
+    fan_out(post, followers)
+    return followers
+
+
+def _keep_pulling(author_id):
+    """Запоминает, что посты автора больше не раскладываются по лентам."""
+    if Profile.objects.filter(user_id=author_id,
+                              pull_posts=False).update(pull_posts=True):
+        cache.delete(CELEBRITIES_KEY)
+        objects.forget(Profile, user_id=author_id)
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту подписчика последние посты автора.
+
+    Посты популярного автора подмешиваются при чтении, поэтому ленту
+    подписчика они не заполняют. Автор остаётся подмешиваемым и после
+    отписок: иначе его старые посты так и не попали бы в эту ленту.
+    """
+    if is_celebrity(author_id):
+        _keep_pulling(author_id)
+        return
+    posts = Post.objects.filter(author_id=author_id).order_by(
+        '-pub_date', '-pk').values_list('pk', 'pub_date')
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, post_id=pk,
+                       author_id=author_id, pub_date=pub_date)
+         for pk, pub_date in posts[:settings.FEED_BACKFILL_LIMIT]),
+        batch_size=settings.FEED_BATCH_SIZE,
+        ignore_conflicts=True
+    )
+
+
+def trim(user_id, author_id):
+    """Убирает из ленты подписчика посты автора."""
+    TimelineEntry.objects.filter(user_id=user_id,
+                                 author_id=author_id).delete()
+
+
+def timeline(user):
+    return TimelineEntry.objects.filter(user=user).select_related(
+        'post__author', 'post__group'
+    ).only('post', 'pub_date', *(f'post__{name}' for name in FEED_FIELDS))
+
+
+def _following_key(user_id):
+    return f'posts:following:{user_id}'
+
+
+def _unpack(data):
+    ids = array('q')
+    ids.frombytes(data)
+    return ids
+
+
+def following_ids(user_id):
+    """Отсортированный массив id авторов, на которых подписан пользователь.
+
+    В кэше массив хранится байтами: восемь байт на подписку. Снимок
+    из базы записывается под арендой ключа, чтобы change_following()
+    не применилась к нему раньше, чем он попадёт в кэш.
+    """
+    key = _following_key(user_id)
+    data = cache.get(key)
+    if data is not None:
+        return _unpack(data)
+    with locked(key) as acquired:
+        data = cache.get(key) if acquired else None
+        if data is not None:
+            return _unpack(data)
+        ids = array('q', sorted(Follow.objects.filter(
+            user_id=user_id).values_list('author_id', flat=True)))
+        if acquired:
+            cache.set(key, ids.tobytes(), settings.FEED_FOLLOWING_TIMEOUT)
+    return ids
+
+
+def _position(ids, author_id):
+    index = bisect_left(ids, author_id)
+    return index, index < len(ids) and ids[index] == author_id
+
+
+def followed_among(user_id, author_ids):
+    """Те из author_ids, на кого подписан пользователь, за одно чтение."""
+    ids = following_ids(user_id)
+    return {author_id for author_id in author_ids
+            if _position(ids, author_id)[1]}
+
+
+def is_following(user_id, author_id):
+    return bool(followed_among(user_id, [author_id]))
+
+
+def change_following(user_id, author_id, followed):
+    """Добавляет автора в закэшированный массив подписок или убирает.
+
+    Изменение повторяется после фиксации транзакции: снимок, прочитанный
+    из базы до неё, мог попасть в кэш уже после первого изменения.
+    """
+    def change():
+        key = _following_key(user_id)
+        with locked(key) as acquired:
+            if not acquired:
+                cache.delete(key)
+                return
+            data = cache.get(key)
+            if data is None:
+                return
+            ids = _unpack(data)
+            index, present = _position(ids, author_id)
+            if followed and not present:
+                ids.insert(index, author_id)
+            elif not followed and present:
+                del ids[index]
+            else:
+                return
+            cache.set(key, ids.tobytes(), settings.FEED_FOLLOWING_TIMEOUT)
+
+    change()
+    transaction.on_commit(change)
+
+
+def followed_celebrities(user):
+    celebrities = celebrity_ids()
+    if not celebrities:
+        return []
+    return sorted(followed_among(user.pk, celebrities))
+
+
+def pulled_posts(author_ids):
+    return Post.objects.filter(author_id__in=author_ids).for_feed()
@@ -0,0 +1,115 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .thumbnails import lookup_many
+
+ARTICLE_TEMPLATE = 'posts/includes/post_article.html'
+FRAGMENT_PARAMS = ('page', 'after', 'before')
+
+
+def _version_key(key):
+    return f'posts:version:{key}'
+
+
+def get_versions(keys):
+    """Текущие версии лент; пропавшие из кэша получают новое значение.
+
+    Новая версия берётся из часов, а не начинается с нуля, чтобы не
+    совпасть с версией фрагментов, сохранённых до вытеснения счётчика.
+    """
+    cache_keys = [_version_key(key) for key in keys]
+    versions = cache.get_many(cache_keys)
+    missing = {cache_key: time.time_ns() for cache_key in cache_keys
+               if cache_key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return [versions[cache_key] for cache_key in cache_keys]
+
+
+def bump_versions(keys):
+    for key in keys:
+        try:
+            cache.incr(_version_key(key))
+        except ValueError:
+            # Версии нет в кэше — при чтении будет выдана новая.
+            pass
+
+
+def depend_on(request, *keys):
+    """Запоминает версии лент, от которых зависит ответ.
+
+    По ним PageCacheMiddleware решает, можно ли отдать страницу из кэша.
+    """
+    versions = dict(zip(keys, get_versions(keys)))
+    request.feed_versions = {**getattr(request, 'feed_versions', {}),
+                             **versions}
+    return versions
+
+
+def feed_etag(request, *keys):
+    """ETag страницы по версиям её лент, без запросов к базе и отрисовки.
+
+    Для вошедшего пользователя в тег входят его id и ключ сессии:
+    страница показывает его меню и формы с CSRF-токеном, который
+    меняется при каждом входе вместе с сессией.
+    """
+    parts = [f'{key}@{version}'
+             for key, version in zip(keys, get_versions(keys))]
+    if request.user.is_authenticated:
+        parts.append(f'user:{request.user.pk}')
+        parts.append(request.session.session_key or '')
+    return hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+
+def fragment_context(request, *keys):
+    """Ключ фрагментов страницы: view, версии лент и страница/курсор.
+
+    Шаблон передаёт fragment_key в {% cache %} как vary_on, поэтому
+    изменение любой из лент делает старые фрагменты недоступными.
+    """
+    parts = [request.resolver_match.view_name]
+    parts.extend(f'{key}@{version}'
+                 for key, version in depend_on(request, *keys).items())
+    parts.extend(f'{name}={request.GET[name]}'
+                 for name in FRAGMENT_PARAMS if name in request.GET)
+    return {
+        'fragment_key': '|'.join(parts),
+        'fragment_timeout': settings.FEED_FRAGMENT_TIMEOUT,
+    }
+
+
+def article_key(post):
+    # pub_date отличает пост от другого с тем же id в пересозданной базе.
+    return (f'posts:article:{post.pk}:{post.pub_date.timestamp()}:'
+            f'{post.version}')
+
+
+def render_articles(posts):
+    """Отрисованные карточки постов: одно чтение кэша на страницу.
+
+    Недостающие карточки отрисовываются и сохраняются одной записью;
+    миниатюры постов без сохранённых путей заранее читаются из
+    KV-хранилища одним запросом.
+    """
+    keys = [article_key(post) for post in posts]
+    articles = cache.get_many(keys)
+    absent = [(key, post) for key, post in zip(keys, posts)
+              if key not in articles]
+    # Посты с путями миниатюр в своих полях KV-хранилище не читают.
+    thumbnails = lookup_many([post.image for key, post in absent
+                              if not post.image_thumbnails])
+    missing = {
+        key: render_to_string(ARTICLE_TEMPLATE,
+                              {'post': post, 'thumbnails': thumbnails})
+        for key, post in absent
+    }
+    if missing:
+        cache.set_many(missing, settings.FEED_ARTICLE_TIMEOUT)
+        articles.update(missing)
+    return [mark_safe(articles[key]) for key in keys]
@@ -0,0 +1,70 @@
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image, ImageOps
+
+# Форматы, которые сохраняются с параметром quality.
+LOSSY_FORMATS = ('JPEG', 'WEBP')
+
+
+def prepare_upload(upload):
+    """Проверяет загруженное изображение и готовит его к сохранению.
+
+    Формат и размеры читаются из заголовка, без декодирования пикселей.
+    Изображения больше POST_IMAGE_MAX_PIXELS отклоняются. Стороны
+    больше POST_IMAGE_MAX_SIDE уменьшаются один раз здесь, а EXIF
+    удаляется с учётом ориентации; остальные файлы, кроме MPO, не
+    перекодируются.
+    """
+    upload.seek(0)
+    try:
+        image = Image.open(upload)
+    except (Image.DecompressionBombError, OSError):
+        raise ValidationError('Загрузите корректное изображение.',
+                              code='invalid_image')
+    with image:
+        # Снимки телефонов со стереопарой или картой глубины Pillow
+        # открывает как MPO: это JPEG с дополнительными кадрами.
+        # Сохраняется только первый, перекодированный в JPEG.
+        is_mpo = image.format == 'MPO'
+        image_format = 'JPEG' if is_mpo else image.format
+        if image_format not in settings.POST_IMAGE_FORMATS:
+            raise ValidationError(
+                'Формат %(format)s не поддерживается.',
+                code='invalid_format', params={'format': image.format})
+        width, height = image.size
+        if width * height > settings.POST_IMAGE_MAX_PIXELS:
+            raise ValidationError(
+                'Изображение слишком большое: %(width)s×%(height)s.',
+                code='too_many_pixels',
+                params={'width': width, 'height': height})
+        max_side = settings.POST_IMAGE_MAX_SIDE
+        oversized = max(width, height) > max_side
+        if getattr(image, 'is_animated', False) and not is_mpo:
+            if oversized:
+                raise ValidationError(
+                    'Анимация не должна быть больше %(side)s точек.',
+                    code='animation_too_large', params={'side': max_side})
+            upload.seek(0)
+            return upload
+        if not (is_mpo or oversized or 'exif' in image.info):
+            upload.seek(0)
+            return upload
+        return _reencode(image, upload, max_side, image_format)
+
+
+def _reencode(image, upload, max_side, image_format):
+    # Для JPEG декодер сразу уменьшает изображение в 2–8 раз.
+    image.draft(image.mode, (max_side, max_side))
+    image = ImageOps.exif_transpose(image)
+    image.info.pop('exif', None)
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+    options = {}
+    if image_format in LOSSY_FORMATS:
+        options['quality'] = settings.POST_IMAGE_QUALITY
+    output = BytesIO()
+    image.save(output, image_format, **options)
+    return SimpleUploadedFile(upload.name, output.getvalue(),
+                              upload.content_type)
@@ -0,0 +1,37 @@
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand
+
+from posts import thumbnails
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = ('Находит миниатюры, созданные до перехода поля image на '
+            'ContentAddressedStorage (миграция 0006), и записывает их '
+            'пути в посты. Запускается один раз после обновления; '
+            'оставшиеся без миниатюр посты обработает rebuild_thumbnails.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        # До 0006 поле image хранилось в FileSystemStorage, и ключи sorl
+        # готовых миниатюр построены от него.
+        legacy = FileSystemStorage()
+        names = Post.objects.exclude(image='').filter(
+            image_thumbnails='').order_by('image').values_list(
+            'image', flat=True).distinct()
+        last_name = ''
+        adopted = 0
+        while True:
+            chunk = list(names.filter(
+                image__gt=last_name)[:options['chunk_size']])
+            if not chunk:
+                break
+            last_name = chunk[-1]
+            found = thumbnails.adopt_legacy(chunk, legacy)
+            if found:
+                # update() обходит сигналы: карточки отрисуются заново.
+                thumbnails.refresh_posts(Post.objects.filter(image__in=found))
+            adopted += len(found)
+        self.stdout.write(f'Найдены миниатюры изображений: {adopted}.')
@@ -0,0 +1,70 @@
+from django.core.files.images import get_image_dimensions
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from core import objects
+from posts import thumbnails
+from posts.models import IMAGE_FIELDS, Post
+
+
+class Command(BaseCommand):
+    help = ('Заполняет размеры изображений и пути миниатюр у постов, '
+            'сохранённых до появления этих полей. Миниатюры берутся из '
+            'KV-хранилища sorl; посты без готовых миниатюр остаются для '
+            'rebuild_thumbnails.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(image='').filter(
+            Q(image_width__isnull=True) | Q(image_thumbnails='')
+        ).order_by('pk').only('pk', 'image', *IMAGE_FIELDS)
+        last_pk = 0
+        updated = missing_files = missing_thumbnails = 0
+        while True:
+            chunk = list(posts.filter(pk__gt=last_pk)[:options['chunk_size']])
+            if not chunk:
+                break
+            last_pk = chunk[-1].pk
+            resolved = thumbnails.lookup_many(post.image for post in chunk)
+            for post in chunk:
+                problem = self._fill(post, resolved)
+                if problem == 'file':
+                    missing_files += 1
+                elif problem == 'thumbnails':
+                    missing_thumbnails += 1
+            # bulk_update() обходит сигналы, поэтому кэш объектов
+            # сбрасывается здесь. Карточки не меняются: они и так
+            # брали миниатюры из KV-хранилища.
+            Post.objects.bulk_update(chunk, IMAGE_FIELDS)
+            for post in chunk:
+                objects.forget(Post, pk=post.pk)
+            updated += len(chunk)
+        self.stdout.write(f'Обработано постов: {updated}.')
+        if missing_files:
+            self.stdout.write(self.style.WARNING(
+                f'Нет файла изображения: {missing_files}.'))
+        if missing_thumbnails:
+            self.stdout.write(self.style.WARNING(
+                f'Нет готовых миниатюр: {missing_thumbnails}, запустите '
+                f'rebuild_thumbnails.'))
+
+    def _fill(self, post, resolved):
+        """Заполняет поля поста; возвращает, чего не хватило, или None."""
+        if post.image_width is None:
+            try:
+                post.image_width, post.image_height = get_image_dimensions(
+                    post.image)
+            except OSError:
+                return 'file'
+            finally:
+                post.image.close()
+        if not post.image_thumbnails:
+            found = {key: thumbnail
+                     for (name, key), thumbnail in resolved.items()
+                     if name == post.image.name}
+            if not all(found.values()):
+                return 'thumbnails'
+            post.image_thumbnails = thumbnails.describe(found)
+        return None
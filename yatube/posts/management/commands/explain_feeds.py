@@ -0,0 +1,103 @@
+import re
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.http import Http404
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from core import objects
+from posts import feeds
+from posts.models import Comment, Group, Post, Profile
+from posts.paginators import (CommentPaginator, CursorPaginator,
+                              HybridTimelinePaginator, encode_cursor)
+from posts.views import get_post
+
+User = get_user_model()
+
+# «SCAN posts_post» без «USING ...» — чтение всей таблицы.
+FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\S+)(?: AS \S+)?$')
+TEMP_SORT = 'USE TEMP B-TREE'
+
+
+class Command(BaseCommand):
+    help = ('Выполняет EXPLAIN QUERY PLAN для запросов лент и страницы '
+            'поста и завершается с ошибкой, если какой-то из них читает '
+            'таблицу целиком или сортирует её во временном B-дереве.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('EXPLAIN QUERY PLAN поддерживается '
+                               'только для SQLite.')
+        problems = []
+        for name, queries in self._feed_queries():
+            for sql in queries:
+                plan = self._explain(sql)
+                bad = [row for row in plan
+                       if FULL_SCAN.match(row) or TEMP_SORT in row]
+                status = self.style.ERROR('FAIL') if bad else 'ok'
+                self.stdout.write(f'{status:<4} {name}: {sql[:100]}')
+                for row in plan:
+                    self.stdout.write(f'       {row}')
+                problems.extend(f'{name}: {row}' for row in bad)
+        if problems:
+            raise CommandError('Запросы без подходящего индекса:\n'
+                               + '\n'.join(problems))
+
+    def _explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+
+    def _capture(self, func):
+        with CaptureQueriesContext(connection) as context:
+            func()
+        return [query['sql'] for query in context.captured_queries]
+
+    def _paginate(self, posts, paginator_class=CursorPaginator, **kwargs):
+        cursor = encode_cursor((timezone.now(), 0))
+
+        def run():
+            paginator_class(posts, 10, **kwargs).get_cursor_page()
+            paginator_class(posts, 10, **kwargs).get_cursor_page(
+                after=cursor)
+            paginator_class(posts, 10, **kwargs).get_cursor_page(
+                before=cursor)
+            paginator_class(posts, 10, **kwargs).get_page(2)
+        return self._capture(run)
+
+    def _detail(self, post):
+        """Запросы get_post() со страницы поста, когда его нет в кэше."""
+        def run():
+            objects.forget(Post, pk=post.pk)
+            objects.forget(User, pk=post.author_id)
+            objects.forget(Profile, user_id=post.author_id)
+            objects.forget(Group, pk=post.group_id)
+            try:
+                get_post(post.pk)
+            except Http404:
+                pass
+        return self._capture(run)
+
+    def _feed_queries(self):
+        group = Group.objects.first() or Group(pk=0)
+        user = User.objects.first() or User(pk=0)
+        authors = list(User.objects.values_list('pk', flat=True)[:2]) or [0, 1]
+        post = Post.objects.first() or Post(pk=0)
+        return [
+            ('index', self._paginate(Post.objects.for_feed())),
+            ('group_posts', self._paginate(
+                Post.objects.filter(group=group).for_feed())),
+            ('profile', self._paginate(
+                Post.objects.filter(author=user).for_feed())),
+            ('follow_index', self._paginate(
+                feeds.timeline(user), HybridTimelinePaginator)),
+            ('follow_index pulled', self._paginate(
+                feeds.timeline(user), HybridTimelinePaginator,
+                pulled_authors=authors)),
+            ('post_detail', self._detail(post)),
+            ('post_detail comments', self._paginate(
+                Comment.objects.filter(post=post).for_list(),
+                CommentPaginator)),
+        ]
@@ -0,0 +1,170 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import feeds
+from posts.models import Follow, Post
+from posts.paginators import HybridTimelinePaginator
+
+User = get_user_model()
+
+
+def _timed(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def _slope(points):
+    """Наклон прямой по методу наименьших квадратов: мс на единицу x."""
+    n = len(points)
+    mean_x = sum(x for x, y in points) / n
+    mean_y = sum(y for x, y in points) / n
+    spread = sum((x - mean_x) ** 2 for x, y in points)
+    if not spread:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / spread
+
+
+def _crossing(points, budget):
+    """Первое x, при котором y превышает budget, по линейной интерполяции.
+
+    None, если бюджет не превышен ни в одной точке.
+    """
+    previous = None
+    for x, y in points:
+        if y > budget:
+            if previous is None or previous[1] >= y:
+                return x
+            x0, y0 = previous
+            return round(x0 + (budget - y0) * (x - x0) / (y - y0))
+        previous = x, y
+    return None
+
+
+class Command(BaseCommand):
+    help = ('Измеряет задержку раскладки поста по лентам (push) в '
+            'зависимости от числа подписчиков и стоимость чтения ленты '
+            '(pull) в зависимости от числа подмешиваемых авторов. Порог '
+            'FEED_CELEBRITY_FOLLOWERS выводится из бюджета задержки '
+            'публикации. Все данные создаются bulk_create() без сигналов '
+            'в транзакции и откатываются, поэтому счётчики и версии в '
+            'кэше не меняются.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--followers', type=int, nargs='+',
+                            default=[10, 100, 1000, 10000])
+        parser.add_argument('--pulled', type=int, nargs='+',
+                            default=[0, 1, 5, 20, 50],
+                            help='Числа подмешиваемых авторов в ленте')
+        parser.add_argument('--budget', type=float, default=50.0,
+                            help='Допустимая задержка публикации, мс')
+        parser.add_argument('--read-budget', type=float, default=20.0,
+                            help='Допустимое время чтения ленты, мс')
+        parser.add_argument('--reads', type=float, default=1.0,
+                            help='Чтений ленты подписчиком на один пост '
+                                 'автора')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--per-page', type=int, default=10)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self._run(sorted(options['followers']),
+                      sorted(options['pulled']), options)
+            transaction.set_rollback(True)
+
+    def _run(self, sizes, pulled, options):
+        per_page = options['per_page']
+        User.objects.bulk_create(
+            User(username=f'feed-benchmark-{i}')
+            for i in range(sizes[-1] + pulled[-1] + 2))
+        users = list(User.objects.filter(
+            username__startswith='feed-benchmark-').values_list(
+            'pk', flat=True))
+        # Первый автор раскладывается, следующие pulled[-1] подмешиваются.
+        authors = users[:pulled[-1] + 1]
+        followers = users[pulled[-1] + 1:]
+        Post.objects.bulk_create(
+            Post(author_id=author_id, text=f'Пост {i}')
+            for author_id in authors for i in range(per_page * 2))
+        posts = list(Post.objects.filter(author_id=authors[0]))
+        Follow.objects.bulk_create(
+            Follow(user_id=user_id, author_id=authors[0])
+            for user_id in followers)
+        reader = User(pk=followers[0])
+        for post in posts:
+            feeds.fan_out(post, [reader.pk])
+
+        push = self._push(posts[0], followers[1:], sizes, options)
+        read = self._read(reader, authors[1:], pulled, options)
+        self._report(push, read, options)
+
+    def _push(self, post, followers, sizes, options):
+        """Задержка публикации, мс, для каждого числа подписчиков."""
+        self.stdout.write(f'{"followers":>10} {"push, ms":>10}')
+        points = []
+        for size in sizes:
+            targets = followers[:size]
+
+            def push():
+                with transaction.atomic():
+                    feeds.fan_out(post, targets)
+                    transaction.set_rollback(True)
+
+            points.append((size, _timed(push, options['repeat'])))
+            self.stdout.write(f'{size:>10} {points[-1][1]:>10.2f}')
+        return points
+
+    def _read(self, reader, pulled_authors, pulled, options):
+        """Время чтения первой страницы ленты, мс, от числа авторов."""
+        self.stdout.write(f'{"pulled":>10} {"read, ms":>10}')
+        points = []
+        for count in pulled:
+            authors = pulled_authors[:count]
+
+            def read():
+                HybridTimelinePaginator(
+                    feeds.timeline(reader), options['per_page'],
+                    pulled_authors=authors
+                ).get_cursor_page()
+
+            points.append((count, _timed(read, options['repeat'])))
+            self.stdout.write(f'{count:>10} {points[-1][1]:>10.2f}')
+        return points
+
+    def _report(self, push, read, options):
+        push_slope, read_slope = _slope(push), _slope(read)
+        self.stdout.write(
+            f'Раскладка: {push_slope * 1000:.2f} мкс на подписчика. '
+            f'Подмешивание: {read_slope:.2f} мс на автора при каждом '
+            f'чтении ленты; от числа подписчиков автора оно не зависит.')
+        # Обе суммарные стоимости растут линейно с числом подписчиков,
+        # поэтому точки пересечения по суммарной работе нет: решает
+        # сравнение наклонов, а порог задаётся бюджетом задержки.
+        if push_slope and read_slope:
+            ratio = read_slope * options['reads'] / push_slope
+            cheaper = 'раскладка' if ratio > 1 else 'подмешивание'
+            self.stdout.write(
+                f'При {options["reads"]} чтениях на пост суммарно '
+                f'дешевле {cheaper} (в {max(ratio, 1 / ratio):.1f} раза).')
+
+        threshold = _crossing(push, options['budget'])
+        if threshold is None:
+            self.stdout.write(
+                f'Раскладка укладывается в {options["budget"]} мс для всех '
+                f'размеров; порог больше {push[-1][0]} подписчиков.')
+        else:
+            self.stdout.write(self.style.WARNING(
+                f'Раскладка превышает {options["budget"]} мс начиная '
+                f'примерно с {threshold} подписчиков: это порог '
+                f'FEED_CELEBRITY_FOLLOWERS (сейчас '
+                f'{settings.FEED_CELEBRITY_FOLLOWERS}).'))
+        limit = _crossing(read, options['read_budget'])
+        if limit is not None:
+            self.stdout.write(self.style.WARNING(
+                f'Чтение ленты превышает {options["read_budget"]} мс при '
+                f'{limit} подмешиваемых авторах в подписках.'))
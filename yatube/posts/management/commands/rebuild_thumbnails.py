@@ -0,0 +1,139 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from posts import thumbnails
+from posts.models import Post
+
+# Файл прогресса лежит рядом с миниатюрами, а не в кэше: кэш вытесняет
+# записи и очищается после миграций.
+PROGRESS_FILE = 'rebuild_thumbnails.progress'
+
+
+def _render_chunk(image_names, force):
+    results = []
+    for image_name in image_names:
+        try:
+            results.append(thumbnails.render(image_name, force))
+        except Exception as error:
+            results.append((image_name, str(error)))
+    return results
+
+
+def read_progress(path):
+    try:
+        with open(path) as progress:
+            return int(progress.read())
+    except (OSError, ValueError):
+        return 0
+
+
+def write_progress(path, last_pk):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w') as progress:
+        progress.write(str(last_pk))
+    os.replace(temporary, path)
+
+
+class Command(BaseCommand):
+    help = ('Создаёт миниатюры POST_THUMBNAILS для всех постов с '
+            'изображениями в нескольких процессах. Посты читаются '
+            'пачками по первичному ключу по мере обработки; после '
+            'прерывания команда продолжает с последней записанной пачки.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=100)
+        parser.add_argument('--checkpoint', type=int, default=10,
+                            help='Пачек между записями в KV-хранилище')
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+        parser.add_argument('--force', action='store_true',
+                            help='Пересоздать уже существующие файлы')
+        parser.add_argument('--restart', action='store_true',
+                            help='Начать с начала, забыв прогресс')
+        parser.add_argument('--progress-file',
+                            help='Файл прогресса, по умолчанию '
+                                 f'{PROGRESS_FILE} в MEDIA_ROOT')
+
+    def handle(self, *args, **options):
+        self.progress_file = options['progress_file'] or os.path.join(
+            settings.MEDIA_ROOT, PROGRESS_FILE)
+        if options['restart'] and os.path.exists(self.progress_file):
+            os.remove(self.progress_file)
+        self.last_pk = read_progress(self.progress_file)
+        if self.last_pk:
+            self.stdout.write(f'Продолжение после поста {self.last_pk}.')
+        self.checkpoint = options['checkpoint']
+
+        self.started = time.monotonic()
+        self.done = 0
+        self.pending = []
+        # В очереди пула не больше двух пачек на процесс: остальные
+        # ещё не прочитаны из базы.
+        window = deque()
+        with ProcessPoolExecutor(options['workers'],
+                                 initializer=django.setup) as pool:
+            for last_pk, names in self._chunks(self.last_pk,
+                                               options['chunk_size']):
+                window.append((last_pk, pool.submit(
+                    _render_chunk, names, options['force'])))
+                if len(window) >= 2 * options['workers']:
+                    self._collect(*window.popleft())
+            while window:
+                self._collect(*window.popleft())
+        self._flush()
+        if os.path.exists(self.progress_file):
+            os.remove(self.progress_file)
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: {self.done} изображений, {self._rate():.1f} в секунду.'))
+
+    def _chunks(self, start_pk, size):
+        rows = Post.objects.exclude(image='').order_by('pk').values_list(
+            'pk', 'image')
+        last_pk = start_pk
+        while True:
+            chunk = list(rows.filter(pk__gt=last_pk)[:size])
+            # Процессы пула создаются при отправке пачки и не должны
+            # унаследовать подключение к базе.
+            connections.close_all()
+            if not chunk:
+                return
+            last_pk = chunk[-1][0]
+            yield last_pk, [image_name for pk, image_name in chunk]
+
+    def _collect(self, last_pk, future):
+        self.pending.append((last_pk, future.result()))
+        if len(self.pending) >= self.checkpoint:
+            self._flush()
+
+    def _rate(self):
+        return self.done / max(time.monotonic() - self.started, 1e-9)
+
+    def _flush(self):
+        """Пишет готовые пачки в KV-хранилище и запоминает прогресс."""
+        if not self.pending:
+            return
+        rendered = []
+        for last_pk, results in self.pending:
+            for result in results:
+                if isinstance(result[1], str):
+                    self.stderr.write(f'{result[0]}: {result[1]}')
+                else:
+                    rendered.append(result)
+        thumbnails.store_rendered(rendered)
+        thumbnails.record_rendered(rendered)
+        first_pk, last_pk = self.last_pk, self.pending[-1][0]
+        thumbnails.refresh_posts(Post.objects.filter(
+            pk__gt=first_pk, pk__lte=last_pk).exclude(image=''))
+        write_progress(self.progress_file, last_pk)
+        self.last_pk = last_pk
+        self.done += sum(len(results) for last_pk, results in self.pending)
+        self.pending = []
+        self.stdout.write(f'До поста {last_pk}: {self.done} изображений, '
+                          f'{self._rate():.1f} в секунду.')
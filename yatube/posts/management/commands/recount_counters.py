@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core import objects
+from posts.counters import recount
+from posts.counts import feed_key
+from posts.fragments import bump_versions
+from posts.models import Post, Profile
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает счётчики постов, подписчиков и комментариев '
+            'по фактическим данным.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user_ids, post_ids = recount()
+        # update() обходит сигналы, поэтому кэш объектов и версии
+        # страниц сбрасываются здесь, уже после фиксации.
+        for user_id in user_ids:
+            objects.forget(Profile, user_id=user_id)
+        for post_id in post_ids:
+            objects.forget(Post, pk=post_id)
+        bump_versions([
+            *(feed_key('author', user_id) for user_id in user_ids),
+            *(feed_key('post', post_id) for post_id in post_ids),
+        ])
+        self.stdout.write(self.style.SUCCESS(
+            f'Счётчики пересчитаны: профилей {len(user_ids)}, '
+            f'постов {len(post_ids)}.'))
@@ -0,0 +1,80 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+
+from core import singleflight
+
+from .fragments import get_versions
+
+CACHE_HEADER = 'X-Page-Cache'
+
+
+def _page_key(request):
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f'posts:page:{path}'
+
+
+class PageCacheMiddleware:
+    """Кэш целых страниц для анонимных посетителей.
+
+    Сохраняются только ответы view, объявивших свои ленты через
+    fragment_context(). Вместе со страницей хранятся версии этих лент;
+    если при чтении хоть одна версия изменилась, страница строится
+    заново; сохранённый ETag позволяет ответить 304 без отрисовки.
+    Перестраивает устаревшую страницу один запрос, остальные тем
+    временем получают прежнюю. Заголовок X-Page-Cache (hit/miss/stale)
+    показывает результат.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.method != 'GET' or request.user.is_authenticated:
+            return self.get_response(request)
+
+        key = _page_key(request)
+        entry = cache.get(key)
+        if entry is None:
+            response = self.get_response(request)
+            self._store(request, key, response)
+            return response
+
+        *_, versions, fresh_until = entry
+        if (time.time() < fresh_until
+                and get_versions(list(versions)) == list(versions.values())):
+            return self._cached(request, entry, 'hit')
+        if not singleflight.acquire(key):
+            # Страницу уже перестраивает другой запрос.
+            return self._cached(request, entry, 'stale')
+        try:
+            response = self.get_response(request)
+            self._store(request, key, response)
+        finally:
+            singleflight.release(key)
+        return response
+
+    def _cached(self, request, entry, status):
+        content, content_type, etag, *_ = entry
+        response = HttpResponse(content, content_type=content_type)
+        if etag:
+            response['ETag'] = etag
+        response = get_conditional_response(request, etag=etag,
+                                            response=response)
+        response[CACHE_HEADER] = status
+        return response
+
+    def _store(self, request, key, response):
+        versions = getattr(request, 'feed_versions', None)
+        if (versions and response.status_code == 200
+                and not response.streaming
+                and not request.META.get('CSRF_COOKIE_USED')):
+            fresh_until = time.time() + settings.PAGE_CACHE_TIMEOUT
+            cache.set(key, (response.content, response['Content-Type'],
+                            response.get('ETag'), versions, fresh_until),
+                      settings.PAGE_CACHE_TIMEOUT + settings.STAMPEDE_GRACE)
+            response[CACHE_HEADER] = 'miss'
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.16 on 2026-10-18 06:24
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_celebrities(apps, schema_editor):
+    # Посты нынешних популярных авторов уже не разложены по лентам.
+    Profile = apps.get_model('posts', 'Profile')
+    Profile.objects.filter(
+        followers_count__gte=settings.FEED_CELEBRITY_FOLLOWERS
+    ).update(pull_posts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0007_post_image_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='pull_posts',
+            field=models.BooleanField(db_index=True, default=False, verbose_name='Посты подмешиваются'),
+        ),
+        migrations.RunPython(mark_celebrities, migrations.RunPython.noop),
+    ]
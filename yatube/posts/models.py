@@ -1,8 +1,34 @@
 from django.contrib.auth import get_user_model
+from django.core.files.images import get_image_dimensions
 from django.db import models
 
+from .storage import ContentAddressedStorage
+
 User = get_user_model()
 
+# Поля, которые выводят posts_list.html и post_detail.html.
+FEED_FIELDS = (
+    'text', 'pub_date', 'image', 'image_width', 'image_height',
+    'image_thumbnails', 'author', 'group', 'version',
+    'author__username', 'author__first_name', 'author__last_name',
+    'group__title', 'group__slug',
+)
+COMMENT_FIELDS = ('text', 'created', 'post', 'author', 'author__username')
+# Поля, которые Post.save() заполняет по загруженной картинке.
+IMAGE_FIELDS = ('image_width', 'image_height', 'image_thumbnails')
+
+
+class PostQuerySet(models.QuerySet):
+    def for_feed(self):
+        """Посты с автором и группой одним запросом, только нужные поля."""
+        return self.select_related('author', 'group').only(*FEED_FIELDS)
+
+
+class CommentQuerySet(models.QuerySet):
+    def for_list(self):
+        """Комментарии с автором одним запросом, только нужные поля."""
+        return self.select_related('author').only(*COMMENT_FIELDS)
+
 
 class Post(models.Model):
     text = models.TextField(
@@ -28,15 +54,86 @@ class Post(models.Model):
         verbose_name='Картинка',
         help_text='Загрузите изображение',
         upload_to='posts/',
-        blank=True
+        storage=ContentAddressedStorage(),
+        blank=True,
+        # По имени файла считаются ссылки на него.
+        db_index=True
+    )
+    image_width = models.PositiveIntegerField(
+        verbose_name='Ширина картинки',
+        null=True,
+        blank=True,
+        editable=False
+    )
+    image_height = models.PositiveIntegerField(
+        verbose_name='Высота картинки',
+        null=True,
+        blank=True,
+        editable=False
+    )
+    # JSON со списком готовых миниатюр: вариант, путь и размеры.
+    image_thumbnails = models.TextField(
+        verbose_name='Миниатюры',
+        blank=True,
+        editable=False
     )
+    comments_count = models.PositiveIntegerField(
+        verbose_name='Комментариев',
+        default=0,
+        editable=False
+    )
+    version = models.PositiveIntegerField(
+        verbose_name='Версия',
+        default=0,
+        editable=False
+    )
+
+    objects = PostQuerySet.as_manager()
 
     class Meta:
         ordering = ['-pub_date']
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='post_pub_date'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='post_author_pub_date'),
+            models.Index(fields=['group', '-pub_date', '-id'],
+                         name='post_group_pub_date'),
+        ]
 
     def __str__(self):
         return self.text[:15]
 
+    def save(self, *args, **kwargs):
+        # Версия входит в ключ кэша отрисованного поста. Экземпляр мог
+        # устареть (кэш объектов, refresh_posts() в другом процессе),
+        # поэтому версия увеличивается в самой базе.
+        bump_version = not self._state.adding
+        if bump_version:
+            self.version = models.F('version') + 1
+        # Размеры новой загрузки читаются из заголовка, пока файл под
+        # рукой; пути миниатюр запишет их генерация.
+        filled = ()
+        if self.image and not self.image._committed:
+            self.image_width, self.image_height = get_image_dimensions(
+                self.image)
+            self.image_thumbnails = ''
+            filled = IMAGE_FIELDS
+        elif not self.image:
+            self.image_width = self.image_height = None
+            self.image_thumbnails = ''
+            filled = IMAGE_FIELDS
+        # Частичное сохранение пишет и версию, а при новой картинке —
+        # поля, заполненные выше.
+        if kwargs.get('update_fields') is not None:
+            update_fields = {*kwargs['update_fields'], 'version'}
+            if 'image' in update_fields:
+                update_fields.update(filled)
+            kwargs['update_fields'] = update_fields
+        super().save(*args, **kwargs)
+        if bump_version:
+            self.refresh_from_db(fields=['version'])
+
 
 class Group(models.Model):
     title = models.CharField(max_length=200)
@@ -61,6 +158,14 @@ class Comment(models.Model):
     text = models.TextField(help_text='Напишите что-нибудь')
     created = models.DateTimeField(auto_now_add=True)
 
+    objects = CommentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'created', 'id'],
+                         name='comment_post_created'),
+        ]
+
 
 class Follow(models.Model):
     id = models.AutoField(primary_key=True)
@@ -88,3 +193,57 @@ class Follow(models.Model):
                 name='no_self_subscription'
             ),
         ]
+
+
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(User,
+                             verbose_name='Подписчик',
+                             related_name='timeline',
+                             on_delete=models.CASCADE
+                             )
+    post = models.ForeignKey(Post,
+                             verbose_name='Пост',
+                             related_name='timeline_entries',
+                             on_delete=models.CASCADE
+                             )
+    author = models.ForeignKey(User,
+                               verbose_name='Автор',
+                               related_name='+',
+                               on_delete=models.CASCADE
+                               )
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-post'],
+                         name='timeline_user_pub_date'),
+            models.Index(fields=['user', 'author'],
+                         name='timeline_user_author'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'],
+                                    name='unique_timeline_post'),
+        ]
+
+
+class Profile(models.Model):
+    user = models.OneToOneField(User,
+                                verbose_name='Пользователь',
+                                related_name='profile',
+                                on_delete=models.CASCADE
+                                )
+    posts_count = models.PositiveIntegerField(verbose_name='Постов',
+                                              default=0)
+    followers_count = models.PositiveIntegerField(verbose_name='Подписчиков',
+                                                  default=0,
+                                                  db_index=True)
+    following_count = models.PositiveIntegerField(verbose_name='Подписок',
+                                                  default=0)
+    # Посты автора хотя бы раз не раскладывались по лентам, поэтому
+    # они подмешиваются при чтении, даже если подписчиков стало меньше.
+    pull_posts = models.BooleanField(verbose_name='Посты подмешиваются',
+                                     default=False,
+                                     db_index=True)
+
+    def __str__(self):
+        return str(self.user)
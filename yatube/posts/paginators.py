@@ -0,0 +1,264 @@
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.encoding import force_bytes
+from django.utils.functional import cached_property
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+
+from core.singleflight import get_or_compute
+
+from .counts import feed_key, get_count
+from .feeds import pulled_posts
+from .models import TimelineEntry
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(position):
+    pub_date, pk = position
+    return urlsafe_base64_encode(force_bytes(f'{pub_date.isoformat()}|{pk}'))
+
+
+def keyset(queryset, position, newer=False, date_field='pub_date',
+           id_field='pk'):
+    """Строки очереди по убыванию (date, id) старше или новее позиции.
+
+    Более новые строки возвращаются в обратном порядке — от ближайшей
+    к позиции, чтобы LIMIT отрезал именно соседние с ней записи.
+    """
+    if position is not None:
+        pub_date, pk = position
+        lookup = 'gt' if newer else 'lt'
+        queryset = queryset.filter(
+            Q(**{f'{date_field}__{lookup}': pub_date})
+            | Q(**{date_field: pub_date, f'{id_field}__{lookup}': pk})
+        )
+    return queryset.reverse() if newer else queryset
+
+
+def decode_cursor(token):
+    try:
+        raw = urlsafe_base64_decode(token).decode()
+        pub_date, pk = raw.rsplit('|', 1)
+        position = parse_datetime(pub_date), int(pk)
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise InvalidCursor(token)
+    if position[0] is None:
+        raise InvalidCursor(token)
+    return position
+
+
+class CursorPaginator(Paginator):
+    """Keyset-пагинация по (pub_date, id).
+
+    Страницы выбираются условием по курсору и LIMIT, поэтому время
+    ответа не зависит от глубины листания: ни COUNT(*), ни OFFSET
+    не выполняются. Обычный постраничный режим (?page=N) остаётся
+    доступен через унаследованные методы Paginator; если передан
+    count_key, число постов берётся из кэша счётчиков ленты.
+    """
+    date_field = 'pub_date'
+    id_field = 'pk'
+    ELLIPSIS = '…'
+    on_each_side = 2
+    on_ends = 1
+
+    def __init__(self, object_list, per_page, count_key=None, **kwargs):
+        object_list = object_list.order_by(f'-{self.date_field}',
+                                           f'-{self.id_field}')
+        super().__init__(object_list, per_page, **kwargs)
+        self.count_key = count_key
+        self.cursor_mode = False
+        self.next_cursor = None
+        self.previous_cursor = None
+        self.elided_page_range = []
+
+    @cached_property
+    def count(self):
+        if self.count_key is None:
+            return super().count
+        return get_count(self.count_key, self.object_list)
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        top = bottom + self.per_page
+        if top + self.orphans >= self.count:
+            top = self.count
+        self.elided_page_range = list(self.get_elided_page_range(number))
+        return self._get_page(self._slice(bottom, top), number, self)
+
+    def _slice(self, bottom, top):
+        return self.object_list[bottom:top]
+
+    def get_elided_page_range(self, number=1, *, on_each_side=None,
+                              on_ends=None):
+        """Номера страниц вокруг текущей и по краям, пропуски — ELLIPSIS.
+
+        Число ссылок не зависит от количества постов в ленте.
+        """
+        if on_each_side is None:
+            on_each_side = self.on_each_side
+        if on_ends is None:
+            on_ends = self.on_ends
+        number = self.validate_number(number)
+        num_pages = self.num_pages
+        if num_pages <= (on_each_side + on_ends) * 2:
+            yield from self.page_range
+            return
+
+        if number > (1 + on_each_side + on_ends) + 1:
+            yield from range(1, on_ends + 1)
+            yield self.ELLIPSIS
+            yield from range(number - on_each_side, number + 1)
+        else:
+            yield from range(1, number + 1)
+
+        if number < (num_pages - on_each_side - on_ends) - 1:
+            yield from range(number + 1, number + on_each_side + 1)
+            yield self.ELLIPSIS
+            yield from range(num_pages - on_ends + 1, num_pages + 1)
+        else:
+            yield from range(number + 1, num_pages + 1)
+
+    def _position(self, obj):
+        return getattr(obj, self.date_field), getattr(obj, self.id_field)
+
+    def _fetch(self, position, newer, limit):
+        """До limit строк по одну сторону позиции, начиная с ближайшей."""
+        return list(keyset(self.object_list, position, newer,
+                           self.date_field, self.id_field)[:limit])
+
+    def cursor_page(self, after=None, before=None):
+        """Страница постов старше курсора `after` или новее `before`."""
+        self.cursor_mode = True
+        limit = self.per_page + 1
+        if before:
+            rows = self._fetch(decode_cursor(before), True, limit)
+            has_newer = len(rows) == limit
+            rows = rows[:self.per_page][::-1]
+            has_older = True
+        else:
+            position = decode_cursor(after) if after else None
+            rows = self._fetch(position, False, limit)
+            has_newer = position is not None
+            has_older = len(rows) == limit
+            rows = rows[:self.per_page]
+
+        if rows:
+            if has_newer:
+                self.previous_cursor = encode_cursor(self._position(rows[0]))
+            if has_older:
+                self.next_cursor = encode_cursor(self._position(rows[-1]))
+        return self._get_page(rows, 1, self)
+
+    def get_cursor_page(self, after=None, before=None):
+        """Как cursor_page(), но битый курсор ведёт на первую страницу."""
+        try:
+            return self.cursor_page(after, before)
+        except InvalidCursor:
+            return self.cursor_page()
+
+    def cached_cursor_page(self, cache_key, timeout, after=None,
+                           before=None):
+        """get_cursor_page() через кэш; страницу считает один воркер.
+
+        cache_key должен меняться вместе с содержимым ленты.
+        """
+        def compute():
+            page = self.get_cursor_page(after, before)
+            return list(page), self.previous_cursor, self.next_cursor
+
+        rows, self.previous_cursor, self.next_cursor = get_or_compute(
+            cache_key, compute, timeout)
+        self.cursor_mode = True
+        return Page(rows, 1, self)
+
+
+class TimelinePaginator(CursorPaginator):
+    """Лента подписок из материализованных записей TimelineEntry.
+
+    Ключ курсора (pub_date, post_id) совпадает с ключом ленты постов,
+    а на страницу попадают сами посты.
+    """
+    id_field = 'post_id'
+
+    def _get_page(self, object_list, number, paginator):
+        posts = [entry.post for entry in object_list]
+        return super()._get_page(posts, number, paginator)
+
+
+class HybridTimelinePaginator(TimelinePaginator):
+    """Лента подписок: разложенные записи плюс посты популярных авторов.
+
+    Посты авторов с большим числом подписчиков не копируются в ленты
+    при публикации, а подмешиваются при чтении из их собственной ленты.
+    """
+
+    def __init__(self, object_list, per_page, pulled_authors=(), **kwargs):
+        pulled_authors = list(pulled_authors)
+        if pulled_authors:
+            # Записи, разложенные до того, как автор стал популярным,
+            # пропускаются: его посты целиком берутся из pulled.
+            object_list = object_list.exclude(author_id__in=pulled_authors)
+        super().__init__(object_list, per_page, **kwargs)
+        self.pulled_authors = pulled_authors
+        self.pulled = pulled_posts(self.pulled_authors).order_by(
+            f'-{self.date_field}', '-pk')
+
+    @cached_property
+    def count(self):
+        count = super().count
+        for author_id in self.pulled_authors:
+            count += get_count(feed_key('author', author_id),
+                               self.pulled.filter(author_id=author_id))
+        return count
+
+    def _merge(self, entries, posts, newer=False):
+        rows = {entry.post_id: entry for entry in entries}
+        for post in posts:
+            rows.setdefault(post.pk, TimelineEntry(post=post,
+                                                   pub_date=post.pub_date))
+        return sorted(rows.values(), key=self._position, reverse=not newer)
+
+    def _pulled(self, position=None, newer=False, limit=None):
+        # По запросу на автора: каждый читает диапазон индекса
+        # (author, pub_date) без сортировки всех постов авторов.
+        posts = []
+        for author_id in self.pulled_authors:
+            posts.extend(keyset(self.pulled.filter(author_id=author_id),
+                                position, newer)[:limit])
+        return posts
+
+    def _fetch(self, position, newer, limit):
+        entries = super()._fetch(position, newer, limit)
+        if not self.pulled_authors:
+            return entries
+        posts = self._pulled(position, newer, limit)
+        return self._merge(entries, posts, newer)[:limit]
+
+    def _slice(self, bottom, top):
+        if not self.pulled_authors:
+            return super()._slice(bottom, top)
+        return self._merge(self.object_list[:top],
+                           self._pulled(limit=top))[bottom:top]
+
+
+class CommentPaginator(CursorPaginator):
+    """Комментарии к посту от старых к новым порциями по курсору.
+
+    Порции читаются только вперёд: курсор `after` указывает на
+    последний показанный комментарий.
+    """
+    date_field = 'created'
+
+    def cursor_page(self, after=None, before=None):
+        self.cursor_mode = True
+        position = decode_cursor(after) if after else None
+        rows = self._fetch(position, True, self.per_page + 1)
+        if len(rows) > self.per_page:
+            rows = rows[:self.per_page]
+            self.next_cursor = encode_cursor(self._position(rows[-1]))
+        return self._get_page(rows, 1, self)
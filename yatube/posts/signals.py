@@ -0,0 +1,196 @@
+import logging
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from sorl.thumbnail import delete as delete_thumbnails
+from sorl.thumbnail.images import ImageFile
+
+from core import objects
+from core.singleflight import locked
+
+from . import feeds
+from .counters import bump
+from .counts import change_counts, feed_key, forget_counts, post_feed_keys
+from .fragments import bump_versions
+from .models import Comment, Follow, Group, Post, Profile
+
+logger = logging.getLogger(__name__)
+
+# Поля пользователя, которые выводят страницы; пароль в кэш не попадает.
+USER_FIELDS = ('id', 'username', 'first_name', 'last_name')
+
+objects.watch(Post)
+objects.watch(Group)
+objects.watch(Profile)
+objects.watch(get_user_model(), fields=USER_FIELDS)
+
+
+def _bump_profile(user_id, **deltas):
+    # bump() обходит save(), поэтому объект из кэша сбрасывается здесь.
+    bump(Profile.objects.filter(user_id=user_id), **deltas)
+    objects.forget(Profile, user_id=user_id)
+
+
+def _bump_post(post_id, **deltas):
+    bump(Post.objects.filter(pk=post_id), **deltas)
+    objects.forget(Post, pk=post_id)
+
+
+def _image_key(name):
+    return f'posts:image:{name}'
+
+
+def _release_image(name):
+    """Удаляет файл и его миниатюры, когда на них не ссылается ни один пост.
+
+    Одинаковые загрузки делят один файл (ContentAddressedStorage),
+    поэтому ссылки считаются по полю image после фиксации транзакции,
+    под той же арендой, под которой _keep_image() проверяет новые
+    загрузки. Без аренды файл не удаляется.
+    """
+    if not name:
+        return
+
+    def release():
+        with locked(_image_key(name)) as acquired:
+            if not acquired or Post.objects.filter(image=name).exists():
+                return
+            try:
+                delete_thumbnails(
+                    ImageFile(name, Post._meta.get_field('image').storage))
+            except Exception:
+                # Ответ уже зафиксирован; файл останется лишним, но не
+                # сломает запрос.
+                logger.exception('Не удалось удалить изображение %s', name)
+    transaction.on_commit(release)
+
+
+def _keep_image(instance):
+    """Возвращает на место файл новой загрузки, если его успели удалить.
+
+    Загрузка, совпавшая с уже сохранённым файлом, не пишет его заново,
+    а _release_image() другого поста не видит её до фиксации транзакции
+    и может удалить файл. Поэтому после фиксации файл проверяется.
+    """
+    upload = instance.__dict__.pop('_upload', None)
+    if upload is None:
+        return
+    name = instance.image.name
+    storage = instance.image.storage
+
+    def keep():
+        with locked(_image_key(name)):
+            try:
+                upload.open()
+                storage.restore(name, upload)
+            except Exception:
+                logger.exception('Не удалось восстановить изображение %s',
+                                 name)
+    transaction.on_commit(keep)
+
+
+@receiver(pre_save, sender=Post)
+def remember_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    if instance.image and not instance.image._committed:
+        instance._upload = instance.image.file
+    if instance._state.adding:
+        return
+    saved = Post.objects.filter(pk=instance.pk).values_list(
+        'group_id', 'image').first()
+    instance._saved_group_id, instance._saved_image = saved or (None, '')
+
+
+@receiver(post_save, sender=Post)
+def count_saved_post(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    _keep_image(instance)
+    if created:
+        _bump_profile(instance.author_id, posts_count=1)
+        followers = feeds.push_post(instance)
+        keys = post_feed_keys(instance, followers)
+        change_counts(keys, 1)
+        bump_versions(keys)
+        return
+    keys = post_feed_keys(instance, feeds.push_targets(instance.author_id))
+    keys.append(feed_key('post', instance.pk))
+    previous_image = getattr(instance, '_saved_image', '')
+    if previous_image != instance.image.name:
+        _release_image(previous_image)
+    previous_group_id = getattr(instance, '_saved_group_id', None)
+    if previous_group_id:
+        keys.append(feed_key('group', previous_group_id))
+    bump_versions(keys)
+    if previous_group_id != instance.group_id:
+        if previous_group_id:
+            change_counts([feed_key('group', previous_group_id)], -1)
+        if instance.group_id:
+            change_counts([feed_key('group', instance.group_id)], 1)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    _bump_profile(instance.author_id, posts_count=-1)
+    followers = feeds.push_targets(instance.author_id)
+    keys = post_feed_keys(instance, followers)
+    change_counts(keys, -1)
+    bump_versions([*keys, feed_key('post', instance.pk)])
+    _release_image(instance.image.name)
+
+
+@receiver(post_save, sender=Follow)
+def fill_timeline(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        _count_follow(instance, 1)
+        feeds.change_following(instance.user_id, instance.author_id, True)
+        feeds.backfill(instance.user_id, instance.author_id)
+    forget_counts([feed_key('follow', instance.user_id)])
+    _bump_follow(instance)
+
+
+@receiver(post_delete, sender=Follow)
+def trim_timeline(sender, instance, **kwargs):
+    _count_follow(instance, -1)
+    feeds.change_following(instance.user_id, instance.author_id, False)
+    feeds.trim(instance.user_id, instance.author_id)
+    forget_counts([feed_key('follow', instance.user_id)])
+    _bump_follow(instance)
+
+
+def _bump_follow(follow):
+    # Профиль автора показывает число подписчиков.
+    bump_versions([feed_key('follow', follow.user_id),
+                   feed_key('author', follow.author_id)])
+
+
+def _count_follow(follow, delta):
+    _bump_profile(follow.author_id, followers_count=delta)
+    _bump_profile(follow.user_id, following_count=delta)
+
+
+@receiver(post_save, sender=Comment)
+def count_saved_comment(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        _bump_post(instance.post_id, comments_count=1)
+    bump_versions([feed_key('post', instance.post_id)])
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    _bump_post(instance.post_id, comments_count=-1)
+    bump_versions([feed_key('post', instance.post_id)])
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def create_profile(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        Profile.objects.get_or_create(user=instance)
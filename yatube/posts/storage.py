@@ -0,0 +1,37 @@
+import hashlib
+import os
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+CHUNK_SIZE = 64 * 1024
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, которое называет файлы по SHA-256 содержимого.
+
+    Одинаковые загрузки получают одно имя и один файл на диске, а значит,
+    и общие миниатюры sorl; файл, который уже есть, повторно не пишется.
+    Файл удаляется, только когда на него не ссылается ни один пост, —
+    за этим следят сигналы постов.
+    """
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks(CHUNK_SIZE):
+            digest.update(chunk)
+        content.seek(0)
+        hexdigest = digest.hexdigest()
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        name = os.path.join(directory, hexdigest[:2], hexdigest + extension)
+        if self.exists(name):
+            return name
+        return super()._save(name, content)
+
+    def restore(self, name, content):
+        """Записывает файл под уже выданным именем, если его нет."""
+        if not self.exists(name):
+            super()._save(name, content)
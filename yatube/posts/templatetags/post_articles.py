@@ -0,0 +1,10 @@
+from django import template
+
+from ..fragments import render_articles
+
+register = template.Library()
+
+
+@register.simple_tag
+def post_articles(posts):
+    return render_articles(list(posts))
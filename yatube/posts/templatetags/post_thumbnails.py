@@ -0,0 +1,15 @@
+from django import template
+
+from .. import thumbnails
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def post_picture(context, post, name):
+    """Варианты миниатюры для <picture> или None, пока она создаётся.
+
+    Миниатюры, заранее прочитанные для всей страницы (thumbnails
+    в контексте), берутся оттуда без обращения к KV-хранилищу.
+    """
+    return thumbnails.picture(post, name, context.get('thumbnails'))
@@ -1,11 +1,48 @@
+import shutil
+import tempfile
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
 
+from .. import thumbnails
 from ..models import Comment, Follow, Group, Post
 
 User = get_user_model()
 
 
+class TemporaryMediaMixin:
+    """Файлы тестов класса пишутся во временный MEDIA_ROOT.
+
+    Каталог удаляется после последнего теста, а media сайта остаётся
+    нетронутым.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_override = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_override.enable()
+        try:
+            super().setUpClass()
+        except Exception:
+            cls._remove_media_root()
+            raise
+
+    @classmethod
+    def tearDownClass(cls):
+        try:
+            super().tearDownClass()
+        finally:
+            cls._remove_media_root()
+
+    @classmethod
+    def _remove_media_root(cls):
+        cls.media_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+
 def set_up_environment(cls):
     small_gif = (
         b'\x47\x49\x46\x38\x39\x61\x02\x00'
@@ -64,3 +101,10 @@ def set_up_environment(cls):
     )
     cls.POSTS_QTY = len(cls.posts) + 1
     return cls
+
+
+def base_thumbnail(image, name='feed'):
+    """Основная миниатюра name из KV-хранилища sorl или None."""
+    width = int(settings.POST_THUMBNAILS[name][0].split('x')[0])
+    return thumbnails.lookup_many([image]).get(
+        (image.name, (name, width, None)))
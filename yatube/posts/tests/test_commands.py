@@ -0,0 +1,118 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from .. import thumbnails
+from ..management.commands.rebuild_thumbnails import (read_progress,
+                                                      write_progress)
+from ..models import Post, Profile
+from ..tests.fixtures import (TemporaryMediaMixin, base_thumbnail,
+                              set_up_environment)
+
+
+class ExplainFeedsTest(TemporaryMediaMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        set_up_environment(cls)
+
+    def test_feed_queries_use_indexes(self):
+        out = StringIO()
+        call_command('explain_feeds', stdout=out)
+        self.assertNotIn('FAIL', out.getvalue())
+        self.assertIn('post_group_pub_date', out.getvalue())
+        self.assertIn('post_detail: SELECT "posts_post"', out.getvalue())
+        self.assertIn('post_detail: SELECT "posts_profile"', out.getvalue())
+
+
+class RecountCountersTest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        set_up_environment(self)
+
+    def test_recount_counters(self):
+        Profile.objects.update(posts_count=0, followers_count=0)
+        call_command('recount_counters', stdout=StringIO())
+        profile = Profile.objects.get(user=self.author)
+        self.assertEqual(self.POSTS_QTY, profile.posts_count)
+        self.assertEqual(1, profile.followers_count)
+
+    def test_recount_refreshes_cached_pages(self):
+        cache.clear()
+        Profile.objects.filter(user=self.author).update(posts_count=0)
+        url = reverse('posts:profile',
+                      kwargs={'username': self.author.username})
+        self.assertContains(self.client.get(url), 'Всего постов: 0')
+        out = StringIO()
+        call_command('recount_counters', stdout=out)
+        self.assertIn('профилей 1', out.getvalue())
+        self.assertContains(self.client.get(url),
+                            f'Всего постов: {self.POSTS_QTY}')
+
+
+class RebuildThumbnailsTest(TemporaryMediaMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        set_up_environment(cls)
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        self.progress_file = os.path.join(directory, 'progress')
+
+    def test_rebuild_thumbnails(self):
+        out = StringIO()
+        call_command('rebuild_thumbnails', workers=1, chunk_size=4,
+                     checkpoint=1, progress_file=self.progress_file,
+                     stdout=out)
+        for post in Post.objects.all():
+            self.assertIsNotNone(base_thumbnail(post.image))
+        self.assertIn('в секунду', out.getvalue())
+        self.assertFalse(os.path.exists(self.progress_file))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.version, 1)
+
+    def test_rebuild_resumes(self):
+        last_pk = Post.objects.order_by('-pk').values_list(
+            'pk', flat=True).first()
+        write_progress(self.progress_file, last_pk - 1)
+        cache.clear()
+        self.assertEqual(last_pk - 1, read_progress(self.progress_file))
+        call_command('rebuild_thumbnails', workers=1,
+                     progress_file=self.progress_file, stdout=StringIO())
+        self.assertEqual(list(Post.objects.filter(version=1).values_list(
+            'pk', flat=True)), [last_pk])
+
+
+class BackfillImageFieldsTest(TemporaryMediaMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        set_up_environment(cls)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_backfill_image_fields(self):
+        thumbnails.generate(self.post.image.name)
+        Post.objects.update(image_width=None, image_height=None,
+                            image_thumbnails='')
+        call_command('backfill_image_fields', chunk_size=4,
+                     stdout=StringIO())
+        for post in Post.objects.all():
+            self.assertEqual((post.image_width, post.image_height), (2, 1))
+            self.assertEqual(thumbnails.stored(post).keys(),
+                             thumbnails.variants('feed').keys())
+
+    def test_posts_without_thumbnails_are_reported(self):
+        out = StringIO()
+        call_command('backfill_image_fields', stdout=out)
+        self.assertIn('rebuild_thumbnails', out.getvalue())
+        self.assertEqual(Post.objects.get(pk=self.post.pk).image_width, 2)
@@ -0,0 +1,202 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from ..counts import feed_key
+from core import singleflight
+
+from ..feeds import (_following_key, followed_among, followed_celebrities,
+                     following_ids, is_celebrity, is_following, timeline)
+from ..fragments import get_versions
+from ..models import Follow, Post, TimelineEntry
+from ..paginators import HybridTimelinePaginator, TimelinePaginator
+from ..tests.fixtures import TemporaryMediaMixin, set_up_environment
+
+User = get_user_model()
+
+
+class TimelineTest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        set_up_environment(self)
+
+    def test_follow_backfills_timeline(self):
+        self.assertEqual(self.POSTS_QTY, self.follower.timeline.count())
+        self.assertFalse(self.user.timeline.exists())
+
+    @override_settings(FEED_BACKFILL_LIMIT=3)
+    def test_backfill_is_bounded(self):
+        Follow.objects.create(user=self.user, author=self.author)
+        self.assertEqual(3, self.user.timeline.count())
+
+    def test_new_post_is_pushed_to_followers(self):
+        post = Post.objects.create(author=self.author, text='Свежий пост')
+        entry = self.follower.timeline.get(post=post)
+        self.assertEqual(post.pub_date, entry.pub_date)
+        self.assertFalse(TimelineEntry.objects.filter(
+            user=self.user, post=post).exists())
+
+    def test_unfollow_trims_timeline(self):
+        self.follow.delete()
+        self.assertFalse(self.follower.timeline.exists())
+
+    def test_timeline_page_is_one_query(self):
+        expected = list(Post.objects.order_by('-pub_date', '-pk')[:5])
+        paginator = TimelinePaginator(timeline(self.follower), 5)
+        with self.assertNumQueries(1):
+            page = paginator.get_cursor_page()
+            for post in page:
+                post.author.username
+                post.group.slug
+        self.assertEqual(expected, list(page))
+
+
+class FollowSetTest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        set_up_environment(self)
+
+    def test_follow_set_is_cached(self):
+        self.assertEqual([self.author.pk],
+                         list(following_ids(self.follower.pk)))
+        authors = [self.author.pk, self.user.pk, self.follower.pk]
+        with self.assertNumQueries(0):
+            self.assertEqual({self.author.pk},
+                             followed_among(self.follower.pk, authors))
+            self.assertTrue(is_following(self.follower.pk, self.author.pk))
+            self.assertFalse(is_following(self.follower.pk, self.user.pk))
+
+    def test_follow_set_is_updated_in_place(self):
+        following_ids(self.follower.pk)
+        follow = Follow.objects.create(user=self.follower, author=self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(sorted([self.author.pk, self.user.pk]),
+                             list(following_ids(self.follower.pk)))
+        follow.delete()
+        with self.assertNumQueries(0):
+            self.assertEqual([self.author.pk],
+                             list(following_ids(self.follower.pk)))
+
+    def test_follow_set_without_lease_is_dropped(self):
+        following_ids(self.follower.pk)
+        key = _following_key(self.follower.pk)
+        singleflight.acquire(key)
+        with self.settings(STAMPEDE_WAIT=0):
+            Follow.objects.create(user=self.follower, author=self.user)
+        singleflight.release(key)
+        self.assertIsNone(cache.get(key))
+        self.assertTrue(is_following(self.follower.pk, self.user.pk))
+
+    def test_profile_uses_follow_set(self):
+        self.client.force_login(self.follower)
+        url = reverse('posts:profile',
+                      kwargs={'username': self.author.username})
+        self.assertTrue(self.client.get(url).context['following'])
+        self.client.get(reverse('posts:profile_unfollow',
+                                kwargs={'username': self.author.username}))
+        self.assertFalse(self.client.get(url).context['following'])
+
+
+class FollowSetCommitTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create_user(username='reader')
+        self.author = User.objects.create_user(username='author')
+
+    def test_snapshot_written_before_commit_is_patched(self):
+        stale = following_ids(self.reader.pk).tobytes()
+        with transaction.atomic():
+            Follow.objects.create(user=self.reader, author=self.author)
+            # Другой воркер прочитал подписки до фиксации и записал их.
+            cache.set(_following_key(self.reader.pk), stale)
+        self.assertTrue(is_following(self.reader.pk, self.author.pk))
+
+
+@override_settings(FEED_CELEBRITY_FOLLOWERS=2)
+class HybridFeedTest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        set_up_environment(self)
+        Follow.objects.create(user=self.user, author=self.author)
+        cache.clear()
+        self.client.force_login(self.follower)
+
+    def test_celebrity_posts_are_not_pushed(self):
+        self.assertTrue(is_celebrity(self.author.pk))
+        post = Post.objects.create(author=self.author, text='Для всех')
+        self.assertFalse(post.timeline_entries.exists())
+
+    def test_demoted_author_posts_stay_in_feed(self):
+        post = Post.objects.create(author=self.author, text='Для всех')
+        Follow.objects.filter(user=self.user, author=self.author).delete()
+        cache.clear()
+        self.assertTrue(is_celebrity(self.author.pk))
+        response = self.client.get(reverse('posts:follow_index'))
+        self.assertIn(post, response.context['page_obj'])
+
+    def test_follow_during_celebrity_keeps_old_posts(self):
+        Follow.objects.filter(author=self.author).delete()
+        post = Post.objects.create(author=self.author, text='Старый пост')
+        late = User.objects.create_user(username='late')
+        Follow.objects.create(user=self.user, author=self.author)
+        Follow.objects.create(user=self.follower, author=self.author)
+        cache.clear()
+        self.assertTrue(is_celebrity(self.author.pk))
+        Follow.objects.create(user=late, author=self.author)
+        Follow.objects.filter(user__in=[self.user, self.follower],
+                              author=self.author).delete()
+        cache.clear()
+        self.client.force_login(late)
+        response = self.client.get(reverse('posts:follow_index'))
+        self.assertIn(post, response.context['page_obj'])
+
+    def test_follow_index_merges_celebrity_posts(self):
+        post = Post.objects.create(author=self.author, text='Для всех')
+        response = self.client.get(reverse('posts:follow_index'))
+        page = response.context['page_obj']
+        self.assertEqual(post, page[0])
+        self.assertEqual(len(set(page)), len(page))
+
+    def test_merged_pages_do_not_repeat_posts(self):
+        for i in range(3):
+            Post.objects.create(author=self.author, text=f'Пост {i}')
+        expected = list(Post.objects.order_by('-pub_date', '-pk'))
+        seen, after = [], None
+        while True:
+            paginator = HybridTimelinePaginator(
+                timeline(self.follower), 4,
+                pulled_authors=followed_celebrities(self.follower))
+            seen.extend(paginator.get_cursor_page(after=after))
+            after = paginator.next_cursor
+            if after is None:
+                break
+        self.assertEqual(expected, seen)
+
+    def test_offset_pages_count_pulled_posts(self):
+        Post.objects.create(author=self.author, text='Для всех')
+        paginator = HybridTimelinePaginator(
+            timeline(self.follower), 5,
+            pulled_authors=followed_celebrities(self.follower))
+        self.assertEqual(Post.objects.count(), paginator.count)
+        self.assertEqual(list(Post.objects.order_by('-pub_date', '-pk')[5:10]),
+                         list(paginator.get_page(2)))
+
+
+class FeedBenchmarkTest(TestCase):
+    def test_benchmark_runs(self):
+        cache.clear()
+        keys = [feed_key('index')]
+        versions = get_versions(keys)
+        out = StringIO()
+        call_command('feed_benchmark', followers=[1, 3], pulled=[0, 2],
+                     budget=0, repeat=1, stdout=out)
+        self.assertIn('followers', out.getvalue())
+        self.assertIn('pulled', out.getvalue())
+        self.assertIn('FEED_CELEBRITY_FOLLOWERS', out.getvalue())
+        self.assertFalse(Post.objects.exists())
+        self.assertEqual(versions, get_versions(keys))
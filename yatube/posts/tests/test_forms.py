@@ -1,17 +1,22 @@
+import struct
 from http import HTTPStatus
+from io import BytesIO
 
 from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase
+from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from PIL import Image
+
+from ..forms import PostForm
 
 from ..models import Comment, Follow, Post
-from ..tests.fixtures import set_up_environment
+from ..tests.fixtures import TemporaryMediaMixin, set_up_environment
 
 User = get_user_model()
 
 
-class TestPages(TestCase):
+class TestPages(TemporaryMediaMixin, TestCase):
     @classmethod
     def setUpClass(cls):
         super().setUpClass()
@@ -94,6 +99,18 @@ class TestPages(TestCase):
                                kwargs={'username': self.author.username})
         self.assertRedirects(response, redirects_to)
 
+    def test_edit_keeps_concurrent_changes(self):
+        url = reverse('posts:post_edit', kwargs={'post_id': self.post.pk})
+        self.author_client.get(url)
+        Post.objects.filter(pk=self.post.pk).update(
+            comments_count=5, image_thumbnails='[]')
+        self.author_client.post(url, data={'text': 'Новый текст',
+                                           'group': self.group1.pk})
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual('Новый текст', post.text)
+        self.assertEqual(5, post.comments_count)
+        self.assertEqual('[]', post.image_thumbnails)
+
     def test_comment(self):
         comment_count = Comment.objects.count()
         form_data = {
@@ -174,3 +191,84 @@ class TestPages(TestCase):
 
     def tearDown(self):
         del self
+
+
+def _jpeg(size, exif=None, color='red'):
+    output = BytesIO()
+    image = Image.new('RGB', size, color)
+    if exif is None:
+        image.save(output, 'JPEG')
+    else:
+        image.save(output, 'JPEG', exif=exif)
+    return SimpleUploadedFile('photo.jpg', output.getvalue(), 'image/jpeg')
+
+
+def _mpo(size):
+    """JPEG со вторым кадром и индексом MPF, как у снимков телефонов.
+
+    Pillow не записывает MPO, поэтому сегмент APP2 собирается вручную.
+    """
+    first, second = (_jpeg(size, color=color).read()
+                     for color in ('red', 'blue'))
+    entries_offset = 8 + 2 + 3 * 12 + 4
+
+    def segment(second_offset):
+        ifd = (struct.pack('>H', 3)
+               + struct.pack('>HHI4s', 0xB000, 7, 4, b'0100')
+               + struct.pack('>HHII', 0xB001, 4, 1, 2)
+               + struct.pack('>HHII', 0xB002, 7, 32, entries_offset)
+               + struct.pack('>I', 0))
+        entries = (struct.pack('>IIIHH', 0x20030000, len(first), 0, 0, 0)
+                   + struct.pack('>IIIHH', 0x00020002, len(second),
+                                 second_offset, 0, 0))
+        body = b'MPF\x00MM\x00\x2a' + struct.pack('>I', 8) + ifd + entries
+        return b'\xff\xe2' + struct.pack('>H', len(body) + 2) + body
+
+    # Смещения MPF отсчитываются от заголовка TIFF после SOI, маркера,
+    # длины и 'MPF\0'.
+    second_offset = len(first) + len(segment(0)) - 10
+    content = first[:2] + segment(second_offset) + first[2:] + second
+    return SimpleUploadedFile('photo.jpg', content, 'image/jpeg')
+
+
+@override_settings(POST_IMAGE_MAX_SIDE=100, POST_IMAGE_MAX_PIXELS=40_000)
+class ImageUploadTest(TestCase):
+    def clean(self, upload):
+        form = PostForm(data={'text': 'Текст'}, files={'image': upload})
+        form.is_valid()
+        return form
+
+    def test_small_image_is_kept(self):
+        upload = _jpeg((50, 40))
+        form = self.clean(upload)
+        self.assertIs(form.cleaned_data['image'], upload)
+
+    def test_large_image_is_downscaled(self):
+        exif = Image.Exif()
+        exif[0x0110] = 'Camera'
+        form = self.clean(_jpeg((180, 90), exif.tobytes()))
+        with Image.open(form.cleaned_data['image']) as image:
+            self.assertEqual(image.size, (100, 50))
+            self.assertNotIn('exif', image.info)
+
+    def test_exif_is_stripped(self):
+        exif = Image.Exif()
+        exif[0x0110] = 'Camera'
+        form = self.clean(_jpeg((50, 40), exif.tobytes()))
+        with Image.open(form.cleaned_data['image']) as image:
+            self.assertEqual(image.size, (50, 40))
+            self.assertNotIn('exif', image.info)
+
+    def test_mpo_is_saved_as_jpeg(self):
+        upload = _mpo((50, 40))
+        with Image.open(upload) as image:
+            self.assertEqual('MPO', image.format)
+        form = self.clean(upload)
+        with Image.open(form.cleaned_data['image']) as image:
+            self.assertEqual('JPEG', image.format)
+            self.assertEqual(image.size, (50, 40))
+            self.assertGreater(image.getpixel((5, 5))[0], 200)
+
+    def test_too_many_pixels_are_rejected(self):
+        form = self.clean(_jpeg((250, 200)))
+        self.assertIn('image', form.errors)
@@ -1,13 +1,17 @@
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
 
-from ..models import Comment, Follow, Post
-from ..tests.fixtures import set_up_environment
+from ..counters import recount
+from ..models import Comment, Follow, Post, Profile
+from ..tests.fixtures import TemporaryMediaMixin, set_up_environment
 
 User = get_user_model()
 
 
-class ModelsTest(TestCase):
+class ModelsTest(TemporaryMediaMixin, TestCase):
     @classmethod
     def setUpClass(cls):
         super().setUpClass()
@@ -120,3 +124,92 @@ class ModelsTest(TestCase):
 
     def tearDown(self):
         del self
+
+
+class CountersTest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        set_up_environment(self)
+        # Посты из фикстуры созданы через bulk_create, мимо сигналов.
+        recount()
+
+    def _profile(self, user):
+        return Profile.objects.get(user=user)
+
+    def test_recount(self):
+        self.assertEqual(self.POSTS_QTY,
+                         self._profile(self.author).posts_count)
+        self.assertEqual(1, self._profile(self.author).followers_count)
+        self.assertEqual(1, self._profile(self.follower).following_count)
+        self.post.refresh_from_db()
+        self.assertEqual(1, self.post.comments_count)
+
+    def test_profile_created_with_user(self):
+        user = User.objects.create_user(username='newcomer')
+        self.assertEqual(0, self._profile(user).posts_count)
+
+    def test_post_counter(self):
+        post = Post.objects.create(author=self.author, text='Ещё пост')
+        self.assertEqual(self.POSTS_QTY + 1,
+                         self._profile(self.author).posts_count)
+        post.delete()
+        self.assertEqual(self.POSTS_QTY,
+                         self._profile(self.author).posts_count)
+
+    def test_follow_counters(self):
+        follow = Follow.objects.create(user=self.user, author=self.author)
+        self.assertEqual(2, self._profile(self.author).followers_count)
+        self.assertEqual(1, self._profile(self.user).following_count)
+        follow.delete()
+        self.assertEqual(1, self._profile(self.author).followers_count)
+        self.assertEqual(0, self._profile(self.user).following_count)
+
+    def test_comment_counter(self):
+        comment = Comment.objects.create(post=self.post, author=self.user,
+                                         text='Ещё комментарий')
+        self.post.refresh_from_db()
+        self.assertEqual(2, self.post.comments_count)
+        comment.delete()
+        self.post.refresh_from_db()
+        self.assertEqual(1, self.post.comments_count)
+
+    def test_counter_never_goes_negative(self):
+        Profile.objects.filter(user=self.author).update(posts_count=0)
+        self.post.delete()
+        self.assertEqual(0, self._profile(self.author).posts_count)
+
+
+class ImageStorageTest(TemporaryMediaMixin, TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author')
+
+    def create_post(self, content):
+        return Post.objects.create(
+            author=self.author, text='Пост с картинкой',
+            image=SimpleUploadedFile('meme.gif', content, 'image/gif'))
+
+    def test_identical_uploads_share_file(self):
+        first = self.create_post(b'GIF89a same')
+        second = self.create_post(b'GIF89a same')
+        other = self.create_post(b'GIF89a other')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertNotEqual(first.image.name, other.image.name)
+        storage = first.image.storage
+
+        first.delete()
+        self.assertTrue(storage.exists(second.image.name))
+        second.delete()
+        self.assertFalse(storage.exists(second.image.name))
+        other.delete()
+
+    def test_upload_restores_file_released_before_commit(self):
+        first = self.create_post(b'GIF89a race')
+        storage = first.image.storage
+        with transaction.atomic():
+            second = self.create_post(b'GIF89a race')
+            # Удаление первого поста в другом процессе не видит второй
+            # пост, пока его транзакция не зафиксирована.
+            Post.objects.filter(pk=first.pk).delete()
+            storage.delete(second.image.name)
+        self.assertTrue(storage.exists(second.image.name))
+        second.delete()
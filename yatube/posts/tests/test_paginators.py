@@ -0,0 +1,160 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from ..counts import feed_key, get_count
+from ..models import Comment, Follow, Post
+from ..paginators import (CommentPaginator, CursorPaginator, InvalidCursor,
+                          decode_cursor, encode_cursor)
+from ..tests.fixtures import TemporaryMediaMixin, set_up_environment
+
+
+class CursorPaginatorTest(TemporaryMediaMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        set_up_environment(cls)
+        cls.ordered = list(Post.objects.order_by('-pub_date', '-pk'))
+
+    def test_cursor_round_trip(self):
+        position = self.post.pub_date, self.post.pk
+        self.assertEqual(position, decode_cursor(encode_cursor(position)))
+
+    def test_broken_cursor(self):
+        for token in ('', 'garbage', 'MjAyMXwx'):
+            with self.subTest(token=token):
+                with self.assertRaises(InvalidCursor):
+                    decode_cursor(token)
+
+    def test_walk_forward_and_back(self):
+        paginator = CursorPaginator(Post.objects.all(), 5)
+        first = paginator.get_cursor_page()
+        self.assertEqual(self.ordered[:5], list(first))
+        self.assertIsNone(paginator.previous_cursor)
+
+        paginator = CursorPaginator(Post.objects.all(), 5)
+        second = paginator.get_cursor_page(after=first.paginator.next_cursor)
+        self.assertEqual(self.ordered[5:10], list(second))
+
+        paginator = CursorPaginator(Post.objects.all(), 5)
+        third = paginator.get_cursor_page(after=second.paginator.next_cursor)
+        self.assertEqual(self.ordered[10:], list(third))
+        self.assertIsNone(paginator.next_cursor)
+
+        paginator = CursorPaginator(Post.objects.all(), 5)
+        back = paginator.get_cursor_page(
+            before=third.paginator.previous_cursor)
+        self.assertEqual(self.ordered[5:10], list(back))
+        self.assertIsNotNone(paginator.previous_cursor)
+        self.assertIsNotNone(paginator.next_cursor)
+
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        paginator = CursorPaginator(Post.objects.all(), 5)
+        page = paginator.get_cursor_page(after='not-a-cursor')
+        self.assertEqual(self.ordered[:5], list(page))
+
+    def test_cursor_page_does_not_count(self):
+        paginator = CursorPaginator(Post.objects.all(), 5)
+        with self.assertNumQueries(1):
+            paginator.get_cursor_page()
+
+    def test_elided_page_range(self):
+        paginator = CursorPaginator(Post.objects.all(), 1)
+        ellipsis = paginator.ELLIPSIS
+        expected = {
+            1: [1, 2, 3, ellipsis, 11],
+            6: [1, ellipsis, 4, 5, 6, 7, 8, ellipsis, 11],
+            11: [1, ellipsis, 9, 10, 11],
+        }
+        for number, page_range in expected.items():
+            with self.subTest(number=number):
+                self.assertEqual(
+                    page_range,
+                    list(paginator.get_elided_page_range(number)))
+
+    def test_page_sets_elided_range(self):
+        paginator = CursorPaginator(Post.objects.all(), 5)
+        paginator.get_page(2)
+        self.assertEqual([1, 2, 3], paginator.elided_page_range)
+
+
+class CommentPaginatorTest(TemporaryMediaMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        set_up_environment(cls)
+        Comment.objects.bulk_create(
+            Comment(post=cls.post, author=cls.user, text=f'Комментарий {i}')
+            for i in range(6))
+        cls.ordered = list(cls.post.comments.order_by('created', 'pk'))
+
+    def test_chunks_from_oldest(self):
+        comments = self.post.comments.for_list()
+        paginator = CommentPaginator(comments, 4)
+        first = paginator.get_cursor_page()
+        self.assertEqual(self.ordered[:4], list(first))
+        self.assertIsNotNone(paginator.next_cursor)
+
+        paginator = CommentPaginator(comments, 4)
+        with self.assertNumQueries(1):
+            rest = paginator.get_cursor_page(after=first.paginator.next_cursor)
+            self.assertEqual(self.ordered[4:], list(rest))
+            [comment.author.username for comment in rest]
+        self.assertIsNone(paginator.next_cursor)
+
+
+class FeedCountTest(TemporaryMediaMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        set_up_environment(cls)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_count_is_cached(self):
+        key = feed_key('author', self.author.pk)
+        posts = self.author.posts.all()
+        self.assertEqual(self.POSTS_QTY, get_count(key, posts))
+        paginator = CursorPaginator(posts, 5, count_key=key)
+        with self.assertNumQueries(0):
+            self.assertEqual(3, paginator.num_pages)
+
+    def test_counts_follow_post_writes(self):
+        keys = {
+            feed_key('index'): Post.objects.all(),
+            feed_key('group', self.group1.pk): self.group1.post_group.all(),
+            feed_key('author', self.author.pk): self.author.posts.all(),
+            feed_key('follow', self.follower.pk): Post.objects.filter(
+                author__following__user=self.follower),
+        }
+        before = {key: get_count(key, qs) for key, qs in keys.items()}
+        post = Post.objects.create(author=self.author, text='Новый пост',
+                                   group=self.group1)
+        for key, qs in keys.items():
+            with self.subTest(key=key):
+                self.assertEqual(before[key] + 1, get_count(key, qs))
+
+        post.group = self.empty_group
+        post.save()
+        group_key = feed_key('group', self.group1.pk)
+        self.assertEqual(before[group_key],
+                         get_count(group_key, keys[group_key]))
+
+        post.delete()
+        for key, qs in keys.items():
+            with self.subTest(key=key):
+                self.assertEqual(before[key], get_count(key, qs))
+
+    def test_follow_resets_follow_count(self):
+        key = feed_key('follow', self.user.pk)
+        posts = Post.objects.filter(author__following__user=self.user)
+        self.assertEqual(0, get_count(key, posts))
+        Follow.objects.create(user=self.user, author=self.author)
+        self.assertEqual(self.POSTS_QTY, get_count(key, posts))
+
+    @override_settings(FEED_COUNT_ESTIMATE_THRESHOLD=1)
+    def test_large_unfiltered_feed_is_estimated(self):
+        max_pk = Post.objects.order_by('-pk').values_list('pk', flat=True)[0]
+        Post.objects.filter(pk=self.post.pk).delete()
+        self.assertEqual(max_pk, get_count(feed_key('index'),
+                                           Post.objects.all()))
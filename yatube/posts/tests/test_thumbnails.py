@@ -0,0 +1,130 @@
+from io import BytesIO, StringIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from PIL import Image
+from sorl.thumbnail import get_thumbnail
+from sorl.thumbnail.images import ImageFile
+
+from .. import thumbnails
+from ..fragments import render_articles
+from ..models import Post
+from ..tests.fixtures import (TemporaryMediaMixin, base_thumbnail,
+                              set_up_environment)
+
+User = get_user_model()
+
+
+class ThumbnailTest(TemporaryMediaMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        set_up_environment(cls)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_pages_do_not_create_thumbnails(self):
+        response = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}))
+        self.assertContains(response, 'img/placeholder.svg')
+        self.assertIsNone(base_thumbnail(self.post.image))
+
+    def test_generate_makes_thumbnail_available(self):
+        thumbnails.generate(self.post.image.name)
+        thumbnail = base_thumbnail(self.post.image)
+        self.assertIsNotNone(thumbnail)
+        self.assertEqual((thumbnail.width, thumbnail.height), (960, 339))
+
+    @override_settings(POST_THUMBNAIL_FORMATS=('PNG', 'NO-SUCH-FORMAT'),
+                       POST_THUMBNAIL_WIDTHS=(480, 2000))
+    def test_picture_variants(self):
+        thumbnails.generate(self.post.image.name)
+        post = Post.objects.get(pk=self.post.pk)
+        picture = thumbnails.picture(post, 'feed')
+        self.assertEqual(picture.img.name,
+                         base_thumbnail(post.image).name)
+        self.assertIn('480w', picture.srcset)
+        self.assertIn('960w', picture.srcset)
+        self.assertNotIn('2000w', picture.srcset)
+        (mime_type, srcset), = picture.sources
+        self.assertEqual(mime_type, 'image/png')
+        self.assertIn('.png 480w', srcset)
+
+    def test_generate_invalidates_cached_pages(self):
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        self.client.get(url)
+        thumbnails.generate(self.post.image.name)
+        self.assertEqual(Post.objects.get(pk=self.post.pk).version, 1)
+        response = self.client.get(url)
+        self.assertNotContains(response, 'img/placeholder.svg')
+
+    @override_settings(THUMBNAIL_ASYNC=False)
+    def test_submit_without_pool(self):
+        post = Post.objects.get(text='Тестовый пост 1')
+        thumbnails._submit(post.image.name)
+        self.assertIsNotNone(base_thumbnail(post.image))
+
+    def test_adopt_legacy_thumbnails(self):
+        legacy = FileSystemStorage()
+        geometry, options = settings.POST_THUMBNAILS['feed']
+        thumbnail = get_thumbnail(ImageFile(self.post.image.name, legacy),
+                                  geometry, **options)
+        self.assertIsNone(base_thumbnail(self.post.image))
+        out = StringIO()
+        call_command('adopt_legacy_thumbnails', chunk_size=1, stdout=out)
+        self.assertIn('изображений: 1', out.getvalue())
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual(thumbnail.name,
+                         thumbnails.stored(post)[('feed', 960, None)].name)
+        self.assertEqual(post.version, 1)
+
+    def render_and_count_kv_queries(self):
+        cache.clear()
+        posts = list(Post.objects.for_feed())
+        with CaptureQueriesContext(connection) as context:
+            articles = render_articles(posts)
+        self.assertNotIn('placeholder.svg', articles[0])
+        return len([query for query in context.captured_queries
+                    if 'thumbnail_kvstore' in query['sql']])
+
+    def test_page_thumbnails_are_read_at_once(self):
+        thumbnails.generate(self.post.image.name)
+        Post.objects.update(image_thumbnails='')
+        self.assertEqual(self.render_and_count_kv_queries(), 1)
+
+    def test_stored_thumbnails_skip_kv_store(self):
+        thumbnails.generate(self.post.image.name)
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual((post.image_width, post.image_height), (2, 1))
+        self.assertIn(base_thumbnail(post.image).name,
+                      post.image_thumbnails)
+        self.assertEqual(self.render_and_count_kv_queries(), 0)
+
+
+@override_settings(THUMBNAIL_ASYNC=True)
+class ThumbnailPoolTest(TemporaryMediaMixin, TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='author')
+        self.client.force_login(self.user)
+
+    def test_pool_fills_thumbnails_after_commit(self):
+        output = BytesIO()
+        Image.new('RGB', (40, 20), 'blue').save(output, 'PNG')
+        self.client.post(reverse('posts:post_create'), data={
+            'text': 'Пост с картинкой',
+            'image': SimpleUploadedFile('blue.png', output.getvalue(),
+                                        'image/png')})
+        thumbnails.drain()
+        post = Post.objects.get()
+        self.assertIn(base_thumbnail(post.image).name,
+                      post.image_thumbnails)
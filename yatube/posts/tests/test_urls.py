@@ -4,12 +4,12 @@ from django.contrib.auth import get_user_model
 from django.test import Client, TestCase
 
 from ..models import Follow
-from ..tests.fixtures import set_up_environment
+from ..tests.fixtures import TemporaryMediaMixin, set_up_environment
 
 User = get_user_model()
 
 
-class TestPostsURLS(TestCase):
+class TestPostsURLS(TemporaryMediaMixin, TestCase):
     @classmethod
     def setUpClass(cls):
         super().setUpClass()
@@ -2,17 +2,25 @@ from http import HTTPStatus
 
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
+from django.db import connection
 from django.forms.fields import CharField, ChoiceField
-from django.test import Client, TestCase
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
-from ..models import Follow, Post
-from ..tests.fixtures import set_up_environment
+from core import singleflight
+
+from .. import thumbnails
+from ..fragments import render_articles
+from ..middleware import _page_key
+from ..models import Comment, Follow, Post
+from ..tests.fixtures import TemporaryMediaMixin, set_up_environment
 
 User = get_user_model()
 
 
-class TestPages(TestCase):
+@override_settings(QUERY_BUDGET_RAISE=True)
+class TestPages(TemporaryMediaMixin, TestCase):
     @classmethod
     def setUpClass(cls):
         super().setUpClass()
@@ -82,7 +90,8 @@ class TestPages(TestCase):
         self.assertNotEqual(post.group, self.empty_group)
 
 
-class PaginatorViewsTest(TestCase):
+@override_settings(QUERY_BUDGET_RAISE=True)
+class PaginatorViewsTest(TemporaryMediaMixin, TestCase):
 
     @classmethod
     def setUpClass(cls):
@@ -101,6 +110,7 @@ class PaginatorViewsTest(TestCase):
         cls.POSTS_PER_PAGE = views.POSTS_PER_PAGE
 
     def setUp(self):
+        cache.clear()
         self.authorized_client = Client()
         self.authorized_client.force_login(self.user)
 
@@ -142,7 +152,200 @@ class PaginatorViewsTest(TestCase):
         self.assertNotContains(response, self.posts[-1].text)
 
 
-class TestFollowPages(TestCase):
+@override_settings(QUERY_BUDGET_RAISE=True)
+class FragmentCacheTest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        set_up_environment(self)
+        self.follower_client = Client()
+        self.follower_client.force_login(self.follower)
+        self.urls = [
+            (self.client, reverse('posts:index')),
+            (self.client, reverse('posts:group_posts',
+                                  kwargs={'slug': self.group1.slug})),
+            (self.client, reverse('posts:profile',
+                                  kwargs={'username': self.author.username})),
+            (self.follower_client, reverse('posts:follow_index')),
+        ]
+
+    def test_fragments_are_reused(self):
+        for client, url in self.urls:
+            client.get(url)
+        # Обновление в обход сигналов не меняет версии лент.
+        Post.objects.filter(text=self.posts[-1].text).update(text='Обновлён')
+        for client, url in self.urls:
+            with self.subTest(url=url):
+                self.assertContains(client.get(url), self.posts[-1].text)
+
+    def test_post_save_invalidates_fragments(self):
+        for client, url in self.urls:
+            client.get(url)
+        post = Post.objects.get(text=self.posts[-1].text)
+        post.text = 'Обновлён'
+        post.save()
+        for client, url in self.urls:
+            with self.subTest(url=url):
+                self.assertContains(client.get(url), 'Обновлён')
+
+    def test_pages_have_own_fragments(self):
+        url = reverse('posts:index')
+        first = self.client.get(url).context['page_obj']
+        second = self.client.get(url, {'after': first.paginator.next_cursor})
+        self.assertNotContains(second, f'>{first[0].text}<')
+
+    def test_articles_are_shared_between_listings(self):
+        self.client.get(reverse('posts:index'))
+        response = self.client.get(reverse('posts:group_posts',
+                                           kwargs={'slug': self.group1.slug}))
+        self.assertTemplateUsed(response, 'posts/includes/posts_list.html')
+        self.assertTemplateNotUsed(response,
+                                   'posts/includes/post_article.html')
+
+    def test_post_edit_invalidates_article(self):
+        author_client = Client()
+        author_client.force_login(self.author)
+        post = Post.objects.for_feed().get(pk=self.post.pk)
+        self.assertIn(post.text, render_articles([post])[0])
+
+        Post.objects.filter(pk=post.pk).update(text='В обход сигналов')
+        post = Post.objects.for_feed().get(pk=self.post.pk)
+        self.assertNotIn(post.text, render_articles([post])[0])
+
+        author_client.post(
+            reverse('posts:post_edit', kwargs={'post_id': post.pk}),
+            {'text': 'Исправлено', 'group': self.group1.pk})
+        post = Post.objects.for_feed().get(pk=self.post.pk)
+        self.assertIn('Исправлено', render_articles([post])[0])
+
+    def test_stale_edit_gets_new_version(self):
+        post = Post.objects.get(pk=self.post.pk)
+        # Миниатюры готовы, пока автор редактирует устаревший экземпляр.
+        thumbnails.refresh_posts(Post.objects.filter(pk=post.pk))
+        render_articles([Post.objects.for_feed().get(pk=post.pk)])
+        post.text = 'Исправлено'
+        post.save(update_fields=['text'])
+        self.assertEqual(post.version, 2)
+        post = Post.objects.for_feed().get(pk=self.post.pk)
+        self.assertIn('Исправлено', render_articles([post])[0])
+
+    def test_comment_invalidates_comment_list(self):
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        self.client.get(url)
+        Comment.objects.create(post=self.post, author=self.author,
+                               text='Свежий комментарий')
+        self.assertContains(self.client.get(url), 'Свежий комментарий')
+
+
+@override_settings(QUERY_BUDGET_RAISE=True)
+class PageCacheTest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        set_up_environment(self)
+        self.index_url = reverse('posts:index')
+        self.detail_url = reverse('posts:post_detail',
+                                  kwargs={'post_id': self.post.pk})
+        self.profile_url = reverse('posts:profile',
+                                   kwargs={'username': self.author.username})
+
+    def test_anonymous_pages_are_cached(self):
+        urls = [
+            self.index_url,
+            reverse('posts:group_posts', kwargs={'slug': self.group1.slug}),
+            self.profile_url,
+            self.detail_url,
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual('miss',
+                                 self.client.get(url)['X-Page-Cache'])
+                with self.assertNumQueries(0):
+                    response = self.client.get(url)
+                self.assertEqual('hit', response['X-Page-Cache'])
+
+    def test_hits_keep_security_headers(self):
+        first = self.client.get(self.index_url)
+        response = self.client.get(self.index_url)
+        self.assertEqual('hit', response['X-Page-Cache'])
+        self.assertEqual('SAMEORIGIN', first['X-Frame-Options'])
+        self.assertEqual('SAMEORIGIN', response['X-Frame-Options'])
+
+    def test_stale_page_is_served_during_rebuild(self):
+        request = self.client.get(self.index_url).wsgi_request
+        self.assertTrue(singleflight.acquire(_page_key(request)))
+        Post.objects.create(author=self.user, text='Новый пост')
+        response = self.client.get(self.index_url)
+        self.assertEqual('stale', response['X-Page-Cache'])
+        self.assertNotContains(response, 'Новый пост')
+
+    def test_query_string_is_part_of_key(self):
+        self.client.get(self.index_url)
+        response = self.client.get(self.index_url, {'page': 2})
+        self.assertEqual('miss', response['X-Page-Cache'])
+
+    def test_authorized_pages_are_not_cached(self):
+        self.client.force_login(self.user)
+        self.client.get(self.index_url)
+        self.assertFalse(self.client.get(self.index_url).has_header(
+            'X-Page-Cache'))
+
+    def test_writes_invalidate_pages(self):
+        writes = [
+            (self.index_url, lambda: Post.objects.create(
+                author=self.user, text='Новый пост')),
+            (self.detail_url, lambda: Comment.objects.create(
+                post=self.post, author=self.user, text='Ответ')),
+            (self.profile_url, lambda: Follow.objects.create(
+                user=self.user, author=self.author)),
+        ]
+        for url, write in writes:
+            with self.subTest(url=url):
+                self.client.get(url)
+                write()
+                self.assertEqual('miss',
+                                 self.client.get(url)['X-Page-Cache'])
+
+
+@override_settings(QUERY_BUDGET_RAISE=True)
+class ConditionalGetTest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        set_up_environment(self)
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        self.urls = [
+            reverse('posts:index'),
+            reverse('posts:group_posts', kwargs={'slug': self.group1.slug}),
+            reverse('posts:profile',
+                    kwargs={'username': self.author.username}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        ]
+
+    def test_not_modified(self):
+        for client in (self.client, self.authorized_client):
+            for url in self.urls:
+                with self.subTest(url=url):
+                    etag = client.get(url)['ETag']
+                    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+                    self.assertEqual(HTTPStatus.NOT_MODIFIED,
+                                     response.status_code)
+                    self.assertFalse(response.templates)
+
+    def test_etag_changes_after_write(self):
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        etag = self.authorized_client.get(url)['ETag']
+        Comment.objects.create(post=self.post, author=self.user,
+                               text='Новый комментарий')
+        response = self.authorized_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(HTTPStatus.OK, response.status_code)
+
+    def test_etag_depends_on_user(self):
+        url = reverse('posts:index')
+        self.assertNotEqual(self.client.get(url)['ETag'],
+                            self.authorized_client.get(url)['ETag'])
+
+
+@override_settings(QUERY_BUDGET_RAISE=True)
+class TestFollowPages(TemporaryMediaMixin, TestCase):
 
     def setUp(self):
         set_up_environment(self)
@@ -205,7 +408,8 @@ class TestFollowPages(TestCase):
         del self
 
 
-class TestUnfollow(TestCase):
+@override_settings(QUERY_BUDGET_RAISE=True)
+class TestUnfollow(TemporaryMediaMixin, TestCase):
     def setUp(self):
         set_up_environment(self)
         self.follower_client = Client()
@@ -222,7 +426,8 @@ class TestUnfollow(TestCase):
         self.assertEqual(created_post.text, last_post.text)
 
 
-class TestFollow(TestCase):
+@override_settings(QUERY_BUDGET_RAISE=True)
+class TestFollow(TemporaryMediaMixin, TestCase):
     def setUp(self):
         set_up_environment(self)
 
@@ -235,3 +440,66 @@ class TestFollow(TestCase):
         self.assertEqual(HTTPStatus.OK, response.status_code)
         posts_count = len(response.context['page_obj'])
         self.assertEqual(0, posts_count)
+
+
+@override_settings(QUERY_BUDGET_RAISE=True)
+class TestQueryCount(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        set_up_environment(self)
+        Comment.objects.create(post=self.post, author=self.user,
+                               text='Второй комментарий')
+        self.follower_client = Client()
+        self.follower_client.force_login(self.follower)
+
+    def _queries(self, url, per_page):
+        from .. import views
+
+        per_page_before = views.POSTS_PER_PAGE
+        views.POSTS_PER_PAGE = per_page
+        try:
+            cache.clear()
+            with CaptureQueriesContext(connection) as context:
+                response = self.follower_client.get(url)
+                self.assertEqual(HTTPStatus.OK, response.status_code)
+        finally:
+            views.POSTS_PER_PAGE = per_page_before
+        return len([query for query in context.captured_queries
+                    if query['sql'].startswith('SELECT')])
+
+    def test_listing_queries_do_not_depend_on_page_size(self):
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:group_posts', kwargs={'slug': self.group1.slug}),
+            reverse('posts:profile',
+                    kwargs={'username': self.author.username}),
+            reverse('posts:follow_index'),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(self._queries(url, 2),
+                                 self._queries(url, 10))
+
+    def test_post_comments_fragment(self):
+        from .. import views
+
+        Comment.objects.bulk_create(
+            Comment(post=self.post, author=self.author, text=f'Ещё {i}')
+            for i in range(views.COMMENTS_PER_PAGE))
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        comments = self.follower_client.get(url).context['comments']
+        self.assertEqual(views.COMMENTS_PER_PAGE, len(comments))
+
+        response = self.follower_client.get(
+            reverse('posts:post_comments', kwargs={'post_id': self.post.pk}),
+            {'after': comments.paginator.next_cursor})
+        self.assertTemplateUsed(response, 'posts/includes/comment_list.html')
+        self.assertEqual(2, len(response.context['comments']))
+        self.assertIsNone(response.context['comments'].paginator.next_cursor)
+
+    def test_post_detail_loads_comment_authors(self):
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        before = self._queries(url, 10)
+        Comment.objects.create(post=self.post, author=self.author,
+                               text='Третий комментарий')
+        self.assertEqual(before, self._queries(url, 10))
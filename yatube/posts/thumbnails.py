@@ -0,0 +1,421 @@
+import json
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from threading import Lock
+
+from django.conf import settings
+from django.db import connection, transaction
+from PIL import Image
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.helpers import deserialize, serialize
+from sorl.thumbnail.images import (ImageFile, deserialize_image_file,
+                                   serialize_image_file)
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import EMPTY_VALUE
+from sorl.thumbnail.kvstores.cached_db_kvstore import KVStore as CachedDbStore
+from sorl.thumbnail.models import KVStore
+
+from core import objects
+
+# fragments импортирует этот модуль, поэтому импорт модуля, а не функции.
+from . import feeds, fragments
+from .counters import bump
+from .counts import feed_key, post_feed_keys
+from .models import Post
+
+KV_BATCH_SIZE = 300
+MIME_TYPES = {'GIF': 'image/gif', 'JPEG': 'image/jpeg', 'PNG': 'image/png',
+              'WEBP': 'image/webp'}
+
+# Изображение для <picture>: запасной <img>, его srcset по ширинам и
+# <source> для дополнительных форматов — пары (MIME-тип, srcset).
+Picture = namedtuple('Picture', 'img srcset sources')
+# Миниатюра, записанная в Post.image_thumbnails.
+StoredThumbnail = namedtuple('StoredThumbnail', 'name url width height')
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = Lock()
+_pending = set()
+
+
+def _options(source, options):
+    """Опции миниатюры, дополненные так же, как в get_thumbnail() sorl.
+
+    От них зависит имя файла миниатюры, а значит и ключ в KV-хранилище.
+    """
+    backend = default.backend
+    options = dict(options)
+    if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(sorl_defaults, attr):
+            options.setdefault(key, value)
+    return options
+
+
+def _can_write(image_format):
+    Image.init()
+    return image_format in Image.SAVE
+
+
+def variants(name):
+    """Варианты миниатюры name из POST_THUMBNAILS.
+
+    Ширины из POST_THUMBNAIL_WIDTHS меньше основной с теми же
+    пропорциями и основная ширина — в формате по умолчанию и в каждом
+    формате POST_THUMBNAIL_FORMATS, который умеет записывать Pillow.
+    Ключ варианта — (name, ширина, формат или None).
+    """
+    geometry, options = settings.POST_THUMBNAILS[name]
+    width, height = (int(side) for side in geometry.split('x'))
+    widths = sorted({size for size in settings.POST_THUMBNAIL_WIDTHS
+                     if size < width} | {width})
+    formats = [None, *filter(_can_write, settings.POST_THUMBNAIL_FORMATS)]
+    result = {}
+    for image_format in formats:
+        for size in widths:
+            variant = dict(options)
+            if image_format:
+                variant['format'] = image_format
+            result[name, size, image_format] = (
+                f'{size}x{round(height * size / width)}', variant)
+    return result
+
+
+def _all_variants():
+    result = {}
+    for name in settings.POST_THUMBNAILS:
+        result.update(variants(name))
+    return result
+
+
+def _base_variant(name):
+    geometry, options = settings.POST_THUMBNAILS[name]
+    return name, int(geometry.split('x')[0]), None
+
+
+def _thumbnail(image, geometry, options):
+    source = ImageFile(image)
+    return ImageFile(
+        default.backend._get_thumbnail_filename(
+            source, geometry, _options(source, options)),
+        default.storage)
+
+
+def lookup_many(images):
+    """Все варианты миниатюр для изображений страницы сразу.
+
+    Возвращает {(имя изображения, ключ варианта): ImageFile или None}.
+    Хранилище cached_db читается одним get_many() из кэша и одним
+    запросом к базе для промахов, которые затем кэшируются, как это
+    делает sorl, — в том числе отсутствующие.
+    """
+    thumbnails = {
+        (image.name, key): _thumbnail(image, geometry, options)
+        for image in images if image
+        for key, (geometry, options) in _all_variants().items()
+    }
+    store = default.kvstore
+    if not isinstance(store, CachedDbStore):
+        return {key: store.get(thumbnail)
+                for key, thumbnail in thumbnails.items()}
+    raw_keys = {key: add_prefix(thumbnail.key)
+                for key, thumbnail in thumbnails.items()}
+    values = store.cache.get_many(list(raw_keys.values()))
+    missing = [raw_key for raw_key in raw_keys.values()
+               if raw_key not in values]
+    if missing:
+        found = dict(KVStore.objects.filter(
+            key__in=missing).values_list('key', 'value'))
+        fetched = {raw_key: found.get(raw_key, EMPTY_VALUE)
+                   for raw_key in missing}
+        store.cache.set_many(fetched, sorl_settings.THUMBNAIL_CACHE_TIMEOUT)
+        values.update(fetched)
+    return {
+        key: (None if values[raw_key] == EMPTY_VALUE
+              else deserialize_image_file(values[raw_key]))
+        for key, raw_key in raw_keys.items()
+    }
+
+
+def _srcset(thumbnails):
+    return ', '.join(f'{thumbnail.url} {thumbnail.width}w'
+                     for thumbnail in thumbnails)
+
+
+def describe(thumbnails):
+    """JSON для Post.image_thumbnails из {ключ варианта: ImageFile}."""
+    return json.dumps([
+        [*key, thumbnail.name, thumbnail.width, thumbnail.height]
+        for key, thumbnail in thumbnails.items() if thumbnail is not None
+    ])
+
+
+def stored(post):
+    """Миниатюры из Post.image_thumbnails: без обращения к KV и файлам.
+
+    URL строит хранилище sorl, у FileSystemStorage это работа со строкой.
+    """
+    if not post.image_thumbnails:
+        return {}
+    return {
+        (name, size, image_format): StoredThumbnail(
+            path, default.storage.url(path), width, height)
+        for name, size, image_format, path, width, height
+        in json.loads(post.image_thumbnails)
+    }
+
+
+def picture(post, name, resolved=None):
+    """Picture для миниатюры name у поста или None, пока она не готова.
+
+    Варианты берутся из полей поста; посты без них (до
+    backfill_image_fields) читают KV-хранилище: из resolved — результата
+    lookup_many() — или здесь же. Неготовые варианты пропускаются.
+    """
+    image = post.image
+    if not image:
+        return None
+    base = _base_variant(name)
+    found = stored(post)
+    if base not in found:
+        if resolved is None or (image.name, base) not in resolved:
+            resolved = lookup_many([image])
+        found = {key: resolved.get((image.name, key))
+                 for key in variants(name)}
+    img = found.get(base)
+    if img is None:
+        return None
+    ready = {}
+    for key in variants(name):
+        thumbnail = found.get(key)
+        if thumbnail is not None:
+            ready.setdefault(key[2], []).append(thumbnail)
+    sources = [(MIME_TYPES.get(image_format, ''), _srcset(thumbnails))
+               for image_format, thumbnails in ready.items()
+               if image_format is not None]
+    return Picture(img, _srcset(ready[None]), sources)
+
+
+def refresh_posts(posts):
+    """Новая версия постов и их лент: карточки отрисуются заново.
+
+    Закэшированные карточки с заглушкой или прежними миниатюрами
+    больше не используются.
+    """
+    bump(posts, version=1)
+    keys = set()
+    followers = {}
+    for post in posts.only('pk', 'author_id', 'group_id'):
+        objects.forget(Post, pk=post.pk)
+        if post.author_id not in followers:
+            followers[post.author_id] = feeds.push_targets(post.author_id)
+        keys.update(post_feed_keys(post, followers[post.author_id]))
+        keys.add(feed_key('post', post.pk))
+    fragments.bump_versions(keys)
+
+
+def adopt_legacy(image_names, storage):
+    """Находит миниатюры, созданные, когда у поля image было storage.
+
+    Ключи sorl зависят от класса хранилища исходника, поэтому после его
+    смены готовые миниатюры перестают находиться по ключам. Их пути
+    записываются в посты без Post.image_thumbnails, а список миниатюр —
+    под ключ исходника в нынешнем хранилище, чтобы удаление последнего
+    поста с изображением удаляло и их. Возвращает имена изображений,
+    для которых миниатюры нашлись.
+    """
+    current = Post._meta.get_field('image').storage
+    store = default.kvstore
+    adopted = []
+    for image_name in image_names:
+        legacy = ImageFile(image_name, storage)
+        found = {key: store.get(_thumbnail(legacy, geometry, options))
+                 for key, (geometry, options) in _all_variants().items()}
+        if not any(found.values()):
+            continue
+        Post.objects.filter(image=image_name, image_thumbnails='').update(
+            image_thumbnails=describe(found))
+        keys = store._get(legacy.key, identity='thumbnails')
+        if keys:
+            store._set(ImageFile(image_name, current).key, keys,
+                       identity='thumbnails')
+        adopted.append(image_name)
+    return adopted
+
+
+def record_rendered(results):
+    """Записывает размеры исходников и пути миниатюр в посты с ними."""
+    for source_data, thumbnails_data in results:
+        source = deserialize_image_file(source_data)
+        width, height = source.size
+        Post.objects.filter(image=source.name).update(
+            image_width=width, image_height=height,
+            image_thumbnails=describe({
+                key: deserialize_image_file(data)
+                for key, data in thumbnails_data.items()
+            }))
+
+
+def generate(image_name):
+    """Создаёт все варианты миниатюр изображения и обновляет посты с ним."""
+    results = [render(image_name)]
+    store_rendered(results)
+    record_rendered(results)
+    refresh_posts(Post.objects.filter(image=image_name))
+
+
+def render(image_name, force=False):
+    """Создаёт файлы вариантов миниатюр без обращения к базе и KV.
+
+    Годится для дочерних процессов. Возвращает сериализованный исходник
+    и {ключ варианта: сериализованная миниатюра} для store_rendered()
+    и record_rendered(). Исходник открывается
+    один раз для всех геометрий; готовые файлы без force не
+    пересоздаются.
+    """
+    backend = default.backend
+    # Ключ sorl зависит от хранилища, поэтому берётся хранилище поля.
+    source = ImageFile(image_name, Post._meta.get_field('image').storage)
+    source_image = None
+    rendered = {}
+    try:
+        for key, (geometry, options) in _all_variants().items():
+            options = _options(source, options)
+            thumbnail = ImageFile(
+                backend._get_thumbnail_filename(source, geometry, options),
+                default.storage)
+            if force or not thumbnail.exists():
+                if source_image is None:
+                    source_image = default.engine.get_image(source)
+                    source.set_size(
+                        default.engine.get_image_size(source_image))
+                options['image_info'] = default.engine.get_image_info(
+                    source_image)
+                backend._create_thumbnail(source_image, geometry, options,
+                                          thumbnail)
+            thumbnail.set_size()
+            rendered[key] = serialize_image_file(thumbnail)
+        source.set_size()
+    finally:
+        if source_image is not None:
+            default.engine.cleanup(source_image)
+    return serialize_image_file(source), rendered
+
+
+def _batches(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def store_rendered(results):
+    """Записывает результаты render() в KV-хранилище sorl пачками.
+
+    Вместо двух get_or_create() и чтения списка миниатюр на каждую
+    запись — удаление и bulk_create() по KV_BATCH_SIZE ключей.
+    """
+    values = {}
+    thumbnail_keys = {}
+    for source_data, thumbnails_data in results:
+        source = deserialize_image_file(source_data)
+        values[add_prefix(source.key)] = source_data
+        keys = thumbnail_keys.setdefault(
+            add_prefix(source.key, 'thumbnails'), set())
+        for data in thumbnails_data.values():
+            thumbnail = deserialize_image_file(data)
+            values[add_prefix(thumbnail.key)] = data
+            keys.add(thumbnail.key)
+    for batch in _batches(thumbnail_keys, KV_BATCH_SIZE):
+        for raw_key, value in KVStore.objects.filter(
+                key__in=batch).values_list('key', 'value'):
+            thumbnail_keys[raw_key].update(deserialize(value))
+    values.update((raw_key, serialize(sorted(keys)))
+                  for raw_key, keys in thumbnail_keys.items())
+
+    store = default.kvstore
+    if not isinstance(store, CachedDbStore):
+        for raw_key, value in values.items():
+            store._set_raw(raw_key, value)
+        return
+    with transaction.atomic():
+        for batch in _batches(values, KV_BATCH_SIZE):
+            KVStore.objects.filter(key__in=batch).delete()
+            KVStore.objects.bulk_create(
+                KVStore(key=raw_key, value=values[raw_key])
+                for raw_key in batch)
+    store.cache.set_many(values, sorl_settings.THUMBNAIL_CACHE_TIMEOUT)
+
+
+def _generate_logged(image_name):
+    try:
+        generate(image_name)
+    except Exception:
+        logger.exception('Не удалось создать миниатюры для %s', image_name)
+
+
+def _generate_in_worker(image_name):
+    try:
+        _generate_logged(image_name)
+    finally:
+        # У потока пула своё подключение к базе.
+        connection.close()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                settings.THUMBNAIL_WORKERS,
+                thread_name_prefix='thumbnails')
+        return _executor
+
+
+def _forget_future(future):
+    with _executor_lock:
+        _pending.discard(future)
+
+
+def _submit(image_name):
+    if settings.THUMBNAIL_ASYNC:
+        future = _get_executor().submit(_generate_in_worker, image_name)
+        with _executor_lock:
+            _pending.add(future)
+        future.add_done_callback(_forget_future)
+    else:
+        _generate_logged(image_name)
+
+
+def drain(timeout=None):
+    """Ждёт, пока пул допишет миниатюры, поставленные в очередь."""
+    with _executor_lock:
+        pending = list(_pending)
+    wait(pending, timeout)
+
+
+def enqueue(post):
+    """Ставит создание миниатюр поста в очередь после фиксации транзакции.
+
+    Страницы до этого показывают заглушку и миниатюры сами не создают.
+    У повторной загрузки того же файла миниатюры уже есть: их пути сразу
+    записываются в пост.
+    """
+    if not post.image:
+        return
+    resolved = lookup_many([post.image])
+    if all(resolved.values()):
+        Post.objects.filter(pk=post.pk).update(image_thumbnails=describe(
+            {key: thumbnail for (_, key), thumbnail in resolved.items()}))
+        objects.forget(Post, pk=post.pk)
+        return
+    image_name = post.image.name
+    transaction.on_commit(lambda: _submit(image_name))
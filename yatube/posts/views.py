@@ -1,71 +1,177 @@
+import hashlib
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
-from django.shortcuts import get_object_or_404, redirect, render
+from django.shortcuts import redirect, render
+from django.views.decorators.http import etag
+
+from core.objects import get_cached, get_cached_or_404
 
+from . import thumbnails
+from .counts import feed_key
+from .feeds import followed_celebrities, is_following, timeline
 from .forms import CommentForm, PostForm
-from .models import Follow, Group, Post
+from .fragments import depend_on, feed_etag, fragment_context
+from .models import Comment, Follow, Group, Post, Profile
+from .paginators import (CommentPaginator, CursorPaginator,
+                         HybridTimelinePaginator)
 
+COMMENTS_PER_PAGE = 20
 POSTS_PER_PAGE = 10
 
 
-def get_page(request, posts):
-    paginator = Paginator(posts, POSTS_PER_PAGE)
+def get_page(request, posts, count_key=None,
+             paginator_class=CursorPaginator, fragment_key=None, **kwargs):
+    paginator = paginator_class(posts, POSTS_PER_PAGE, count_key=count_key,
+                                **kwargs)
     page_number = request.GET.get('page')
-    return paginator.get_page(page_number)
-
-
+    if page_number is not None:
+        return paginator.get_page(page_number)
+    after = request.GET.get('after')
+    before = request.GET.get('before')
+    if fragment_key is None:
+        return paginator.get_cursor_page(after, before)
+    # Ключ фрагментов включает версии лент и курсор, поэтому годится
+    # и для строк страницы.
+    digest = hashlib.md5(fragment_key.encode()).hexdigest()
+    return paginator.cached_cursor_page(
+        f'posts:rows:{digest}:{POSTS_PER_PAGE}',
+        settings.FEED_FRAGMENT_TIMEOUT, after, before)
+
+
+def get_author(**lookup):
+    """Пользователь с профилем из кэша объектов."""
+    author = get_cached_or_404(get_user_model(), **lookup)
+    try:
+        author.profile = get_cached(Profile, user_id=author.pk)
+    except Profile.DoesNotExist:
+        pass
+    return author
+
+
+def get_post(post_id):
+    """Пост с автором и группой из кэша объектов."""
+    post = get_cached_or_404(Post, pk=post_id)
+    post.author = get_author(pk=post.author_id)
+    if post.group_id:
+        post.group = get_cached(Group, pk=post.group_id)
+    return post
+
+
+def index_etag(request):
+    return feed_etag(request, feed_key('index'))
+
+
+def group_etag(request, slug):
+    try:
+        group = get_cached(Group, slug=slug)
+    except Group.DoesNotExist:
+        return None
+    return feed_etag(request, feed_key('group', group.pk))
+
+
+def profile_etag(request, username):
+    User = get_user_model()
+    try:
+        author = get_cached(User, username=username)
+    except User.DoesNotExist:
+        return None
+    return feed_etag(request, feed_key('author', author.pk))
+
+
+def post_etag(request, post_id):
+    try:
+        post = get_cached(Post, pk=post_id)
+    except Post.DoesNotExist:
+        return None
+    return feed_etag(request, feed_key('post', post_id),
+                     feed_key('author', post.author_id))
+
+
+@etag(index_etag)
 def index(request):
-    posts = Post.objects.select_related('author', 'group').all()
-    paginator = get_page(request, posts)
+    key = feed_key('index')
+    fragments = fragment_context(request, key)
+    posts = Post.objects.for_feed()
+    paginator = get_page(request, posts, key,
+                         fragment_key=fragments['fragment_key'])
     context = {
         'page_obj': paginator,
+        **fragments
     }
     return render(request, 'posts/index.html', context)
 
 
+@etag(group_etag)
 def group_posts(request, slug):
-    group = get_object_or_404(Group, slug=slug)
-    posts = group.post_group.select_related('author').all()
-    paginator = get_page(request, posts)
+    group = get_cached_or_404(Group, slug=slug)
+    key = feed_key('group', group.pk)
+    fragments = fragment_context(request, key)
+    posts = group.post_group.for_feed()
+    paginator = get_page(request, posts, key,
+                         fragment_key=fragments['fragment_key'])
     context = {
         'group': group,
-        'page_obj': paginator
+        'page_obj': paginator,
+        **fragments
     }
     return render(request, 'posts/group_list.html', context)
 
 
+@etag(profile_etag)
 def profile(request, username):
-    author = get_object_or_404(get_user_model(), username=username)
-    posts = author.posts.all()
-    paginator = get_page(request, posts)
-    is_following = False
+    author = get_author(username=username)
+    key = feed_key('author', author.pk)
+    fragments = fragment_context(request, key)
+    posts = author.posts.for_feed()
+    paginator = get_page(request, posts, key,
+                         fragment_key=fragments['fragment_key'])
+    following = False
     if request.user.is_authenticated and request.user != author:
-        is_following = Follow.objects.filter(user=request.user,
-                                             author=author
-                                             ).exists()
+        following = is_following(request.user.pk, author.pk)
 
     context = {
         'username': username,
         'page_obj': paginator,
         'author': author,
-        'following': is_following
+        'following': following,
+        **fragments
     }
     return render(request, 'posts/profile.html', context)
 
 
+def get_comments(request, post_id):
+    comments = Comment.objects.filter(post_id=post_id).for_list()
+    paginator = CommentPaginator(comments, COMMENTS_PER_PAGE)
+    return paginator.get_cursor_page(after=request.GET.get('after'))
+
+
+@etag(post_etag)
 def post_detail(request, post_id):
-    details = get_object_or_404(Post, pk=post_id)
+    details = get_post(post_id)
     form = CommentForm(request.POST or None)
-    comments = details.comments.all()
+    comments = get_comments(request, details.pk)
+    # Страница показывает и число постов автора.
+    depend_on(request, feed_key('author', details.author_id))
     context = {
         'form': form,
         'post_detail': details,
-        'comments': comments
+        'comments': comments,
+        **fragment_context(request, feed_key('post', details.pk))
     }
     return render(request, 'posts/post_detail.html', context)
 
 
+def post_comments(request, post_id):
+    context = {
+        'post_id': post_id,
+        'comments': get_comments(request, post_id),
+        **fragment_context(request, feed_key('post', post_id))
+    }
+    return render(request, 'posts/includes/comment_list.html', context)
+
+
 @login_required
 def post_create(request):
     form = PostForm(request.POST or None,
@@ -74,18 +180,23 @@ def post_create(request):
         post = form.save(commit=False)
         post.author = request.user
         post.save()
+        thumbnails.enqueue(post)
         return redirect('posts:profile', username=request.user.username)
     return render(request, 'posts/create_post.html', {'form': form})
 
 
 @login_required
 def post_edit(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
+    post = get_cached_or_404(Post, pk=post_id)
     form = PostForm(request.POST or None,
                     files=request.FILES or None,
                     instance=post)
-    if form.is_valid() and post.author == request.user:
-        form.save()
+    if form.is_valid() and post.author_id == request.user.pk:
+        # Пост мог взяться из кэша: полная запись затёрла бы счётчик
+        # комментариев и миниатюры, изменённые с тех пор.
+        form.save(commit=False).save(update_fields=PostForm.Meta.fields)
+        if 'image' in form.changed_data:
+            thumbnails.enqueue(post)
         return redirect('posts:post_detail', post_id=post_id)
     context = {
         'form': form,
@@ -97,7 +208,7 @@ def post_edit(request, post_id):
 @login_required
 def add_comment(request, post_id):
     form = CommentForm(request.POST or None)
-    post = get_object_or_404(Post, pk=post_id)
+    post = get_cached_or_404(Post, pk=post_id)
     if form.is_valid():
         comment = form.save(commit=False)
         comment.author = request.user
@@ -108,16 +219,27 @@ def add_comment(request, post_id):
 
 @login_required
 def follow_index(request):
-    posts = Post.objects.filter(author__following__user=request.user)
-    paginator = get_page(request, posts)
-    context = {'page_obj': paginator}
+    key = feed_key('follow', request.user.pk)
+    pulled_authors = followed_celebrities(request.user)
+    # Посты популярных авторов не раскладываются по лентам, поэтому
+    # фрагмент зависит и от версий их собственных лент.
+    fragments = fragment_context(request, key, *(
+        feed_key('author', author_id) for author_id in pulled_authors))
+    paginator = get_page(request, timeline(request.user), key,
+                         HybridTimelinePaginator,
+                         fragment_key=fragments['fragment_key'],
+                         pulled_authors=pulled_authors)
+    context = {
+        'page_obj': paginator,
+        **fragments
+    }
     return render(request, 'posts/follow.html', context)
 
 
 @login_required
 def profile_follow(request, username):
 
-    author = get_object_or_404(get_user_model(), username=username)
+    author = get_cached_or_404(get_user_model(), username=username)
     user = request.user
     if author != user:
         Follow.objects.get_or_create(user=user, author=author)
@@ -126,7 +248,7 @@ def profile_follow(request, username):
 
 @login_required
 def profile_unfollow(request, username):
-    author = get_object_or_404(get_user_model(), username=username)
+    author = get_cached_or_404(get_user_model(), username=username)
     user = request.user
     Follow.objects.get(user=user, author=author).delete()
     return redirect('posts:profile', username=username)
@@ -26,7 +26,24 @@ CSRF_FAILURE_VIEW = 'core.views.permission_denied_view'
 
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'core.cache.TwoLevelCache',
+        'OPTIONS': {
+            'LOCAL_MAX_ENTRIES': 1000,
+            'LOCAL_TIMEOUT': 5,
+            'SYNC_INTERVAL': 1,
+            'SHARED': {
+                'BACKEND': 'core.cache.SQLiteCache',
+                'LOCATION': os.getenv(
+                    'CACHE_LOCATION',
+                    os.path.join(BASE_DIR, 'cache', 'cache.sqlite3')),
+                'TIMEOUT': 300,
+                'OPTIONS': {
+                    'MAX_ENTRIES': 100000,
+                    'CULL_FREQUENCY': 10,
+                    'LOG_SIZE': 10000,
+                },
+            },
+        },
     }
 }
 
@@ -44,6 +61,19 @@ django_auth_psw = 'django.contrib.auth.password_validation'
 EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
+FEED_ARTICLE_TIMEOUT = 60 * 60 * 24
+FEED_BACKFILL_LIMIT = 1000
+FEED_BATCH_SIZE = 500
+# Раскладка поста занимает около 50 мкс на подписчика и растёт линейно,
+# а подмешивание стоит около 2 мс на автора при каждом чтении ленты.
+# Порог выбран по бюджету задержки публикации в 50 мс (feed_benchmark).
+FEED_CELEBRITY_FOLLOWERS = 1000
+FEED_CELEBRITY_TIMEOUT = 60 * 5
+FEED_COUNT_TIMEOUT = 60 * 15
+FEED_COUNT_ESTIMATE_THRESHOLD = 100_000
+FEED_FOLLOWING_TIMEOUT = 60 * 60
+FEED_FRAGMENT_TIMEOUT = 60 * 10
+
 INSTALLED_APPS = [
     'about.apps.AboutConfig',
     'core.apps.CoreConfig',
@@ -72,6 +102,7 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 MIDDLEWARE = [
+    'core.middleware.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -79,13 +110,53 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Ниже middleware, добавляющих заголовки: ответы из кэша их тоже
+    # получают.
+    'posts.middleware.PageCacheMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
 ]
 
+OBJECT_CACHE_TIMEOUT = 60 * 60
+
+PAGE_CACHE_TIMEOUT = 60 * 5
+
+# Загрузки больше FILE_UPLOAD_MAX_MEMORY_SIZE пишутся во временный файл,
+# а не в память; изображения проверяются по заголовку.
+POST_IMAGE_FORMATS = ('GIF', 'JPEG', 'PNG', 'WEBP')
+POST_IMAGE_MAX_PIXELS = 50_000_000
+POST_IMAGE_MAX_SIDE = 2560
+POST_IMAGE_QUALITY = 90
+
+# Миниатюры, которые создаются после загрузки: имя -> (геометрия, опции).
+POST_THUMBNAILS = {
+    'feed': ('960x339', {'crop': 'center', 'upscale': True}),
+}
+# Дополнительные ширины и форматы каждой миниатюры для srcset/<picture>.
+POST_THUMBNAIL_FORMATS = ('WEBP',)
+POST_THUMBNAIL_WIDTHS = (480, 720)
+
+QUERY_BUDGET_DEFAULT = 12
+# Бюджеты включают одно чтение KV-хранилища sorl на страницу: у постов
+# без Post.image_thumbnails миниатюры ищутся там.
+QUERY_BUDGETS = {
+    'posts:index': 6,
+    'posts:group_posts': 6,
+    'posts:profile': 7,
+    'posts:post_detail': 8,
+    'posts:post_comments': 3,
+    'posts:follow_index': 8,
+}
+QUERY_BUDGET_RAISE = False
+QUERY_REPEAT_LIMIT = 3
+
 ROOT_URLCONF = 'yatube.urls'
 
 SECRET_KEY = os.getenv('DJANGO_KEY')
 
+STAMPEDE_GRACE = 60
+STAMPEDE_LEASE_TIMEOUT = 10
+STAMPEDE_WAIT = 2
+
 STATIC_URL = '/static/'
 STATICFILES_DIRS = (os.path.join(BASE_DIR, 'static'),)
 STATIC_ROOT = os.path.join(BASE_DIR, 'res')
@@ -108,6 +179,11 @@ TEMPLATES = [
     },
 ]
 
+TEST_RUNNER = 'core.runner.IsolatedCacheRunner'
+
+THUMBNAIL_ASYNC = True
+THUMBNAIL_WORKERS = 2
+
 TIME_ZONE = 'UTC'
 
 USE_I18N = True